@@ -0,0 +1,58 @@
+"""
+Compares serial mixing with Mixer.mix_parallel on threads and processes,
+and checks that all of them give identical output.
+
+Usage: python benchmarks/mix_parallel.py [workers ...]
+"""
+
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from cli import create_automatone  # noqa: E402
+from sequence import Mixer  # noqa: E402
+
+# piece and sample rate of the benchmark
+PARAMETERS = {"sequence_length": 512, "tone_range": 24, "interval": 0.125}
+SAMPLE_RATE = 96000
+
+
+def main(worker_counts):
+    sequence = create_automatone(PARAMETERS)._sequence
+    n = int(np.ceil(SAMPLE_RATE * sequence.duration))
+    print(
+        f"{len(sequence)} tones, {n} samples, {os.cpu_count()} CPUs",
+        flush=True,
+    )
+
+    def run(workers, processes):
+        # a new Mixer each time, so that no run reuses cached templates
+        mixer = Mixer(sequence.events, SAMPLE_RATE)
+        out = np.zeros((n, 2))
+        start = time.perf_counter()
+        if workers == 1:
+            mixer.mix(out, 0, range(len(sequence)))
+        else:
+            mixer.mix_parallel(out, workers, processes=processes)
+        return out, time.perf_counter() - start
+
+    reference, serial = run(1, False)
+    print(f"serial: {serial:.2f} s")
+    for workers in worker_counts:
+        for processes in (False, True):
+            out, seconds = run(workers, processes)
+            kind = "processes" if processes else "threads"
+            print(
+                f"{workers} {kind}: {seconds:.2f} s, "
+                f"speedup {serial / seconds:.2f}, "
+                f"identical: {np.array_equal(out, reference)}",
+                flush=True,
+            )
+
+
+if __name__ == "__main__":
+    main([int(arg) for arg in sys.argv[1:]] or [2, 4, 8, 16, 32])
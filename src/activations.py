@@ -1,14 +1,21 @@
-from typing import List, Any
+from typing import Dict, List, Any
 
 import numpy as np
 
-from automata import generate_cellular_automaton
+from automata import (
+    generate_cellular_automaton,
+    generate_combined_automaton,
+)
 from sequence import Sequence
-from tone import Tone
+from tone import wave_id
 
 
 def generate_activations(
-    rules: List[int], tone_range: int, sequence_length: int, skip: int
+    rules: List[int],
+    tone_range: int,
+    sequence_length: int,
+    skip: int,
+    batched: bool = True,
 ) -> np.ndarray[Any, Any]:
     """
     Generates boolean matrices from 1-D cellular automata with
@@ -21,9 +28,19 @@ def generate_activations(
     :param tone_range: range of tones to use in the 12-tone system
     :param sequence_length: sequence length
     :param skip: number of initial tones to skip
+    :param batched: if True, step all rules together and combine rows as
+        they are produced, instead of stacking one matrix per rule
     :return: sequence_length x tone_range boolean matrix
     """
     # we exclude rule 0 and 255, because they produce all 0s or all 1s
+    if batched:
+        return generate_combined_automaton(
+            rules=rules,
+            size=tone_range,
+            steps=sequence_length,
+            skip=skip,
+        )
+
     result = [
         generate_cellular_automaton(
             rule=rule,
@@ -37,6 +54,51 @@ def generate_activations(
     return result
 
 
+def trigger_events(
+    activations: np.ndarray,
+    interval: float,
+    sequence_offset: int,
+    attack_time: float,
+    decay_time: float,
+    sustain_time: float,
+    sustain_level: float,
+    release_time: float,
+    frequencies: List[float],
+    pan: float,
+    volume: float,
+    wave: str,
+    noise_ratio: float,
+) -> Dict[str, np.ndarray]:
+    """
+    given boolean activation matrix, compute the events triggered where
+    matrix == 1 as a columnar event table. All start times and pitches are
+    computed in a single vectorized pass.
+
+    The parameters are the same as for trigger_sounds.
+
+    :return: dictionary mapping each event field (see
+        sequence.EVENT_FIELDS) to an array with one entry per event,
+        ordered by time step and then by tone
+    """
+    time_idx, tone_idx = np.nonzero(activations > 0)
+    n = len(time_idx)
+
+    events = {
+        "start_time": interval * (time_idx + sequence_offset),
+        "attack_time": np.full(n, attack_time, dtype=np.float64),
+        "decay_time": np.full(n, decay_time, dtype=np.float64),
+        "sustain_time": np.full(n, sustain_time, dtype=np.float64),
+        "sustain_level": np.full(n, sustain_level, dtype=np.float64),
+        "release_time": np.full(n, release_time, dtype=np.float64),
+        "pitch": np.asarray(frequencies, dtype=np.float64)[tone_idx],
+        "volume": np.full(n, volume, dtype=np.float64),
+        "pan": np.full(n, pan, dtype=np.float64),
+        "wave": np.full(n, wave_id(wave), dtype=np.int8),
+        "noise_ratio": np.full(n, noise_ratio, dtype=np.float64),
+    }
+    return events
+
+
 def trigger_sounds(
     activations: np.ndarray,
     interval: float,
@@ -70,29 +132,28 @@ def trigger_sounds(
     :param frequencies: list of frequencies to trigger
     :param pan: stereo panning (0=left, 1=right)
     :param volume: volume
-    :param wave: type of soundwave to be used. "sine" or "square"
+    :param wave: type of soundwave to be used, e.g. "sin" or "square"
+        (see oscillators.WAVES)
     :param noise_ratio: amount of noise to be used. 0=no noise, 1=only noise
 
     :return: Sequence object
     """
-    s = Sequence()
+    events = trigger_events(
+        activations,
+        interval=interval,
+        sequence_offset=sequence_offset,
+        attack_time=attack_time,
+        decay_time=decay_time,
+        sustain_time=sustain_time,
+        sustain_level=sustain_level,
+        release_time=release_time,
+        frequencies=frequencies,
+        pan=pan,
+        volume=volume,
+        wave=wave,
+        noise_ratio=noise_ratio,
+    )
 
-    for time_idx in range(activations.shape[0]):
-        for tone_idx in range(activations.shape[1]):
-            if activations[time_idx, tone_idx] > 0:
-                frequency = frequencies[tone_idx]
-                tone = Tone(
-                    start_time=interval * (time_idx + sequence_offset),
-                    attack_time=attack_time,
-                    decay_time=decay_time,
-                    sustain_time=sustain_time,
-                    sustain_level=sustain_level,
-                    release_time=release_time,
-                    pitch=frequency,
-                    volume=volume,
-                    pan=pan,
-                    wave=wave,
-                    noise_ratio=noise_ratio,
-                )
-                s.add([tone])
+    s = Sequence()
+    s.add_events(events)
     return s
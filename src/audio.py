@@ -1,31 +1,218 @@
 import os
-import sys
+import struct
 import logging
+import wave
+from typing import TYPE_CHECKING, Iterable, Union
 
 import numpy as np
-from pydub import AudioSegment
 
-logger = logging.getLogger()
-logger.setLevel(logging.INFO)
-handler = logging.StreamHandler(sys.stdout)
-logger.addHandler(handler)
+if TYPE_CHECKING:
+    from pydub import AudioSegment
 
+logger = logging.getLogger(__name__)
 
-def write_audio(au, sample_rate, output_path) -> None:
+# number of frames converted at once when writing a full array
+WRITE_BLOCK_SIZE = 65536
+
+INT32_MIN = -(2**31)
+INT32_MAX = 2**31 - 1
+
+# WAV format tags of the sample types that can be memory-mapped
+WAV_FORMATS = {"int32": 1, "float32": 3}
+
+# largest size of the data chunk, since WAV stores sizes in 32 bits
+MAX_WAV_DATA_SIZE = 2**32 - 1 - 58
+
+
+def to_int32(
+    block: np.ndarray, out: np.ndarray, scratch: np.ndarray
+) -> np.ndarray:
+    """
+    Converts floats between -1 and 1 into 32-bit PCM samples, without
+    allocating new arrays. Values outside [-1, 1] are clipped.
+
+    :param block: array of floats
+    :param out: int32 array with the same shape as block
+    :param scratch: float64 array with the same shape as block
+    :return: out
+    """
+    np.multiply(block, 2**31, out=scratch)
+    np.clip(scratch, INT32_MIN, INT32_MAX, out=scratch)
+    np.copyto(out, scratch, casting="unsafe")
+    return out
+
+
+def wav_header(
+    n_frames: int, sample_rate: int, dtype: str, channels: int = 2
+) -> bytes:
+    """
+    Creates the header of a WAV file with 32-bit samples, up to the start
+    of the sample data.
+
+    :param n_frames: number of frames in the file
+    :param sample_rate: number of audio samples per second
+    :param dtype: sample type, "int32" (PCM) or "float32" (IEEE float)
+    :param channels: number of channels
+    :return: header bytes
+    """
+    format_tag = WAV_FORMATS[dtype]
+    block_align = 4 * channels
+    data_size = n_frames * block_align
+    if data_size > MAX_WAV_DATA_SIZE:
+        raise ValueError(
+            f"{n_frames} frames do not fit in a WAV file; "
+            f"reduce the sample rate or split the piece"
+        )
+
+    fmt = struct.pack(
+        "<HHIIHH",
+        format_tag,
+        channels,
+        sample_rate,
+        sample_rate * block_align,
+        block_align,
+        32,
+    )
+    chunks = b""
+    if format_tag != WAV_FORMATS["int32"]:
+        # non-PCM formats have an extension size and a fact chunk
+        fmt += struct.pack("<H", 0)
+        chunks += b"fact" + struct.pack("<II", 4, n_frames)
+    chunks = b"fmt " + struct.pack("<I", len(fmt)) + fmt + chunks
+    chunks += b"data" + struct.pack("<I", data_size)
+
+    riff_size = 4 + len(chunks) + data_size
+    return b"RIFF" + struct.pack("<I", riff_size) + b"WAVE" + chunks
+
+
+def open_wav_memmap(
+    path: str,
+    n_frames: int,
+    sample_rate: int,
+    dtype: str = "float32",
+    channels: int = 2,
+) -> np.memmap:
+    """
+    Creates a WAV file of the given size and maps its sample data into
+    memory. Anything written to the returned array ends up in the file,
+    so audio can be rendered straight into it.
+
+    :param path: path of the WAV file
+    :param n_frames: number of frames in the file
+    :param sample_rate: number of audio samples per second
+    :param dtype: sample type, "int32" (PCM) or "float32" (IEEE float)
+    :param channels: number of channels
+    :return: n_frames x channels array backed by the file, filled with 0s
+    """
+    header = wav_header(n_frames, sample_rate, dtype, channels=channels)
+    with open(path, "wb") as f:
+        f.write(header)
+        f.truncate(len(header) + n_frames * channels * 4)
+
+    return np.memmap(
+        path,
+        dtype=np.dtype(dtype).newbyteorder("<"),
+        mode="r+",
+        offset=len(header),
+        shape=(n_frames, channels),
+    )
+
+
+class WavWriter:
+    def __init__(self, path: str, sample_rate: int, channels: int = 2):
+        """
+        A WavWriter writes blocks of float frames (between -1 and 1) to a
+        32-bit PCM WAV file, which is opened once. Each block is converted
+        into reused buffers, so memory use does not depend on the length
+        of the track. The sizes in the header are patched when the writer
+        is closed.
+
+        :param path: path of the WAV file
+        :param sample_rate: number of audio samples per second
+        :param channels: number of channels
+        """
+        self.channels = channels
+        self._file = wave.open(path, "wb")
+        self._file.setnchannels(channels)
+        self._file.setsampwidth(4)
+        self._file.setframerate(sample_rate)
+
+        self._scaled = np.empty((0, channels), dtype=np.float64)
+        self._converted = np.empty((0, channels), dtype=np.int32)
+
+    def write(self, block: np.ndarray) -> None:
+        """
+        Appends a block of frames to the file.
+
+        :param block: n x channels array of floats between -1 and 1
+        :return: None
+        """
+        assert block.shape[1] == self.channels
+        n = len(block)
+        if len(self._converted) < n:
+            self._scaled = np.empty((n, self.channels), dtype=np.float64)
+            self._converted = np.empty((n, self.channels), dtype=np.int32)
+
+        converted = to_int32(block, self._converted[:n], self._scaled[:n])
+
+        self._file.writeframesraw(memoryview(converted).cast("B"))
+
+    def close(self) -> None:
+        self._file.close()
+
+    def __enter__(self) -> "WavWriter":
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+
+def iterate_blocks(arr: np.ndarray, block_size: int) -> Iterable[np.ndarray]:
+    """
+    Splits an array into consecutive blocks without copying.
+
+    :param arr: array to split along the first axis
+    :param block_size: number of rows per block
+    :return: iterator over views on the array
+    """
+    for start in range(0, len(arr), block_size):
+        end = start + block_size
+        yield arr[start:end]
+
+
+def write_audio(
+    au: Union[np.ndarray, Iterable[np.ndarray]], sample_rate, output_path
+) -> None:
+    """
+    Writes audio to audio.wav in the output path.
+
+    :param au: n x 2 array, or an iterable of n x 2 blocks
+        (e.g. from Sequence.render_blocks)
+    :param sample_rate: number of audio samples per second
+    :param output_path: directory to write to
+    :return: None
+    """
     if not (os.path.exists(output_path)):
         os.mkdir(output_path)
 
     audio_path = f"{output_path}/audio.wav"
 
+    if isinstance(au, np.ndarray):
+        au = iterate_blocks(au, WRITE_BLOCK_SIZE)
+
     logger.info(f"Write audio to {audio_path}...")
-    segment = create_audiosegment(au, sample_rate=sample_rate)
     try:
-        segment.export(audio_path, format="wav")
+        with WavWriter(audio_path, sample_rate=sample_rate) as writer:
+            for block in au:
+                writer.write(block)
     except IOError as e:
         logger.error(f"Error writing file: {e}")
 
 
-def create_audiosegment(arr: np.ndarray, sample_rate: int) -> AudioSegment:
+def create_audiosegment(arr: np.ndarray, sample_rate: int) -> "AudioSegment":
+    # pydub is slow to import and only needed here
+    from pydub import AudioSegment
+
     assert arr.shape[1] == 2
     tmp = (arr * 2**31).astype(np.int32)
     result = AudioSegment(
@@ -1,7 +1,23 @@
+import logging
+from functools import lru_cache
+from itertools import islice
+from threading import RLock
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple, Union
+
 import numpy as np
 
+from cache import RenderCache
+
+logger = logging.getLogger(__name__)
+
 U = np.array([[4], [2], [1]])
 
+# number of cells packed into one machine word when unpacking histories
+WORD_SIZE = 64
+
+# number of steps between the states stored by a Trajectory
+CHECKPOINT_INTERVAL = 1024
+
 
 def int_to_bin(rule):
     """
@@ -27,6 +43,88 @@ def step(x, rule_b):
     return rule_b[7 - z]
 
 
+def pack_row(x: np.ndarray) -> int:
+    """
+    Packs a row of cells into an integer, where cell i is stored in bit i.
+
+    :param x: 1-D array of 0s and 1s
+    :return: packed row
+    """
+    result = 0
+    for i in np.flatnonzero(x):
+        result |= 1 << int(i)
+    return result
+
+
+def unpack_rows(rows: List[int], size: int) -> np.ndarray:
+    """
+    Unpacks a list of packed rows (see pack_row) into a boolean matrix.
+
+    Rows are split into 64-bit words, which are then expanded into bits
+    in a single vectorized pass.
+
+    :param rows: packed rows
+    :param size: number of cells per row
+    :return: len(rows) x size int8 matrix
+    """
+    n_words = max(1, -(-size // WORD_SIZE))
+    word_mask = (1 << WORD_SIZE) - 1
+    words = np.array(
+        [
+            [(row >> (WORD_SIZE * k)) & word_mask for k in range(n_words)]
+            for row in rows
+        ],
+        dtype="<u8",
+    ).reshape(len(rows), n_words)
+    bits = np.unpackbits(words.view(np.uint8), axis=1, bitorder="little")
+    return bits[:, :size].astype(np.int8)
+
+
+@lru_cache(maxsize=256)
+def _minterms(rule: int) -> Tuple[Tuple[int, int, int], ...]:
+    """
+    Lists the LCR patterns that a rule maps to 1, as indices into the
+    (left, centre, right, ~left, ~centre, ~right) operands of step_packed.
+
+    :param rule: 8-bit unsigned integer
+    :return: one (L, C, R) index triple per pattern
+    """
+    return tuple(
+        (
+            0 if pattern & 4 else 3,
+            1 if pattern & 2 else 4,
+            2 if pattern & 1 else 5,
+        )
+        for pattern in range(8)
+        if (rule >> pattern) & 1
+    )
+
+
+def step_packed(state: int, rule: int, size: int) -> int:
+    """
+    Compute a single step of an elementary cellular automaton on a packed
+    row (see pack_row). All cells are updated at once using bitwise
+    operations, which is equivalent to step() on the unpacked row.
+
+    :param state: packed row
+    :param rule: which rule the automaton performs
+    :param size: width of the "line" on which the automaton operates
+    :return: packed row after one step
+    """
+    mask = (1 << size) - 1
+    # bit i of left/right holds the left/right neighbour of cell i,
+    # wrapping around the edges like np.roll does in step()
+    left = ((state << 1) | (state >> (size - 1))) & mask
+    right = (state >> 1) | ((state & 1) << (size - 1))
+    operands = (left, state, right, ~left, ~state, ~right)
+
+    # OR together every LCR pattern that the rule maps to 1
+    result = 0
+    for i, j, k in _minterms(rule):
+        result |= operands[i] & operands[j] & operands[k]
+    return result & mask
+
+
 def generate_cellular_automaton(
     rule: int, size: int = 100, steps: int = 100, skip: int = 0
 ) -> np.ndarray:
@@ -36,19 +134,298 @@ def generate_cellular_automaton(
     We always initialize with a zero "line" except for the middle element
     (left of middle if the line length is even)
 
+    Rows are evolved in bit-packed form (see step_packed), and only the
+    rows that are returned are unpacked. Skipped rows are not computed if
+    they were computed before (see skip_ahead).
+
     :param rule: which rule the automaton performs
     :param size: width of the "line" on which the automaton operates
     :param steps: number of times the calculation is performed
     :param skip: number of initial iterations to skip
     """
-    # Compute the binary representation of the rule.
-    rule_b = int_to_bin(rule)
-    x = np.zeros((steps + skip, size), dtype=np.int8)
+    # fixed initial state, advanced by skip steps
+    state = skip_ahead(rule, size, skip)
+
+    rows = []
+    for _ in range(steps):
+        rows.append(state)
+        state = step_packed(state, rule, size)
+
+    return unpack_rows(rows, size)
+
+
+def generate_combined_automaton(
+    rules: Sequence[int], size: int = 100, steps: int = 100, skip: int = 0
+) -> np.ndarray:
+    """
+    Simulate several elementary cellular automata side by side and combine
+    them with the elementwise "and" operation. This is equivalent to
+    multiplying the results of generate_cellular_automaton for each rule,
+    but the rows are combined as they are produced, so only one packed
+    state per rule is kept in memory.
+
+    If the automaton of a rule dies out (all cells 0) and the rule keeps
+    empty neighbourhoods empty, every later row of the combination is 0 as
+    well, so the simulation stops early (see iterate_combined_automaton).
+
+    :param rules: which rules the automata perform
+    :param size: width of the "line" on which the automata operate
+    :param steps: number of times the calculation is performed
+    :param skip: number of initial iterations to skip
+    """
+    rows = iterate_combined_automaton(rules, size=size, skip=skip, packed=True)
+    return unpack_rows(list(islice(rows, steps)), size)
+
+
+def iterate_cellular_automaton(
+    rule: int, size: int = 100, skip: int = 0, packed: bool = False
+) -> Iterator[Union[np.ndarray, int]]:
+    """
+    Simulate an elementary cellular automaton one row at a time, starting
+    from the same initial state as generate_cellular_automaton. Rows are
+    produced as they are requested and never stored, so memory use stays
+    constant however many rows are taken.
+
+    :param rule: which rule the automaton performs
+    :param size: width of the "line" on which the automaton operates
+    :param skip: number of initial iterations to skip
+    :param packed: if True, yield packed rows (see pack_row) instead of
+        arrays
+    :return: endless iterator over the rows
+    """
+    return iterate_combined_automaton(
+        [rule], size=size, skip=skip, packed=packed
+    )
+
+
+def iterate_combined_automaton(
+    rules: Sequence[int], size: int = 100, skip: int = 0, packed: bool = False
+) -> Iterator[Union[np.ndarray, int]]:
+    """
+    Simulate several elementary cellular automata side by side and combine
+    them with the elementwise "and" operation, one row at a time (see
+    generate_combined_automaton and iterate_cellular_automaton). Only one
+    packed state per rule is kept.
+
+    :param rules: which rules the automata perform
+    :param size: width of the "line" on which the automata operate
+    :param skip: number of initial iterations to skip
+    :param packed: if True, yield packed rows (see pack_row) instead of
+        arrays
+    :return: endless iterator over the rows
+    """
+    rules = [int(rule) for rule in rules]
+    mask = (1 << size) - 1
+
+    # fixed initial state, advanced by skip steps, one packed row per rule
+    states = [skip_ahead(rule, size, skip) for rule in rules]
+
+    while True:
+        # a dead automaton stays dead if its rule maps 000 to 0, and so
+        # does every later row of the combination
+        if 0 in states and any(
+            s == 0 and not rule & 1 for s, rule in zip(states, rules)
+        ):
+            break
+        row = mask
+        for s in states:
+            row &= s
+        yield row if packed else unpack_rows([row], size)[0]
+        states = [step_packed(s, rule, size) for s, rule in zip(states, rules)]
+
+    while True:
+        yield 0 if packed else np.zeros(size, dtype=np.int8)
+
+
+class Trajectory:
+    def __init__(self, rule: int, size: int):
+        """
+        A Trajectory records the evolution of the automaton of a rule from
+        the fixed initial state (see generate_cellular_automaton), so that
+        the state after any number of steps can be found without stepping
+        through all of them.
+
+        The state is stored every CHECKPOINT_INTERVAL steps, and a state
+        is computed from the nearest checkpoint before it. Since a line of
+        size cells has at most 2**size states, the automaton eventually
+        repeats a state and runs in a cycle. While new steps are computed,
+        each state is compared with the stored ones; once a state repeats,
+        the cycle is known and any later step maps to a step within the
+        first pass through the cycle, which takes constant time.
+
+        :param rule: which rule the automaton performs
+        :param size: width of the "line" on which the automaton operates
+        """
+        self.rule = rule
+        self.size = size
+        # fixed initial state
+        self.checkpoints: Dict[int, int] = {0: 1 << (size // 2)}
+        # step at which the automaton is in a cycle, and its period
+        self.cycle: Optional[Tuple[int, int]] = None
+        self.modified = False
+        self._steps = {state: step for step, state in self.checkpoints.items()}
+        self._last = 0
+
+    def state_at(self, step: int) -> int:
+        """
+        Computes the state of the automaton after a number of steps.
+
+        :param step: number of steps from the initial state
+        :return: packed state (see pack_row)
+        """
+        if self.cycle is not None:
+            start, period = self.cycle
+            if step > start:
+                step = start + (step - start) % period
+
+        base = min(
+            step // CHECKPOINT_INTERVAL * CHECKPOINT_INTERVAL, self._last
+        )
+        state = self.checkpoints[base]
+        for i in range(base + 1, step + 1):
+            state = step_packed(state, self.rule, self.size)
+            if i <= self._last:
+                continue
+
+            # a state equal to a stored state starts a cycle
+            earlier = self._steps.get(state)
+            if earlier is not None:
+                self.cycle = (earlier, i - earlier)
+                self.modified = True
+                logger.debug(
+                    f"Rule {self.rule}, size {self.size}: cycle of period "
+                    f"{i - earlier} from step {earlier}"
+                )
+                return self.state_at(step)
+
+            if i % CHECKPOINT_INTERVAL == 0:
+                self.checkpoints[i] = state
+                self._steps[state] = i
+                self._last = i
+                self.modified = True
+        return state
+
+    def to_arrays(self) -> Dict[str, np.ndarray]:
+        """
+        Converts the trajectory into arrays, e.g. to store it in a
+        RenderCache (see from_arrays).
+
+        :return: dictionary with the checkpoint steps, the checkpoint
+            states as little-endian bytes, and the cycle (-1 if unknown)
+        """
+        n_bytes = max(1, -(-self.size // 8))
+        steps = sorted(self.checkpoints)
+        states = b"".join(
+            self.checkpoints[step].to_bytes(n_bytes, "little")
+            for step in steps
+        )
+        return {
+            "steps": np.array(steps, dtype=np.int64),
+            "states": np.frombuffer(states, dtype=np.uint8).reshape(
+                -1, n_bytes
+            ),
+            "cycle": np.array(self.cycle or (-1, -1), dtype=np.int64),
+        }
+
+    @classmethod
+    def from_arrays(
+        cls, rule: int, size: int, arrays: Dict[str, np.ndarray]
+    ) -> "Trajectory":
+        """
+        Restores a trajectory from the arrays made by to_arrays.
 
-    # fixed initial state
-    x[0, size // 2] = 1
+        :param rule: which rule the automaton performs
+        :param size: width of the "line" on which the automaton operates
+        :param arrays: dictionary of arrays
+        :return: Trajectory object
+        """
+        trajectory = cls(rule, size)
+        for step, state in zip(arrays["steps"], arrays["states"]):
+            state = int.from_bytes(state.tobytes(), "little")
+            trajectory.checkpoints[int(step)] = state
+            trajectory._steps.setdefault(state, int(step))
+        trajectory._last = max(trajectory.checkpoints)
+        start, period = (int(value) for value in arrays["cycle"])
+        if period > 0:
+            trajectory.cycle = (start, period)
+        return trajectory
+
+
+# trajectories per (rule, size), and the cache in which they are persisted
+_trajectories: Dict[Tuple[int, int], Trajectory] = {}
+_checkpoint_cache: Optional[RenderCache] = None
+# guards the trajectories, which threads that render automatones with the
+# same rule and size (see Composition.render_audio) extend together
+_trajectory_lock = RLock()
+
+
+def use_checkpoint_cache(cache: Optional[RenderCache]) -> None:
+    """
+    Sets the render cache in which trajectories (see Trajectory) are
+    persisted, so that skipped steps are not recomputed by later runs.
+
+    :param cache: render cache, or None to keep trajectories in memory
+    :return: None
+    """
+    global _checkpoint_cache
+    with _trajectory_lock:
+        _checkpoint_cache = cache
+        _trajectories.clear()
+
+
+def get_trajectory(rule: int, size: int) -> Trajectory:
+    """
+    Returns the shared trajectory of a rule and size, loading it from the
+    checkpoint cache (see use_checkpoint_cache) when it is first used.
+
+    :param rule: which rule the automaton performs
+    :param size: width of the "line" on which the automaton operates
+    :return: Trajectory object
+    """
+    key = (rule, size)
+    with _trajectory_lock:
+        if key not in _trajectories:
+            arrays = None
+            if _checkpoint_cache is not None:
+                arrays = _checkpoint_cache.load(
+                    _trajectory_key(*key), "trajectory"
+                )
+            if arrays is None:
+                trajectory = Trajectory(rule, size)
+            else:
+                trajectory = Trajectory.from_arrays(rule, size, arrays)
+            _trajectories[key] = trajectory
+        return _trajectories[key]
+
+
+def _trajectory_key(rule: int, size: int) -> str:
+    return f"automaton-{rule}-{size}"
+
+
+def skip_ahead(rule: int, size: int, skip: int) -> int:
+    """
+    Computes the state of the automaton of a rule after skip steps from
+    the fixed initial state, resuming from the nearest stored state of its
+    trajectory (see Trajectory). New checkpoints are written to the
+    checkpoint cache, if one is set.
+
+    :param rule: which rule the automaton performs
+    :param size: width of the "line" on which the automaton operates
+    :param skip: number of steps
+    :return: packed state (see pack_row)
+    """
+    if skip < CHECKPOINT_INTERVAL:
+        state = 1 << (size // 2)
+        for _ in range(skip):
+            state = step_packed(state, rule, size)
+        return state
 
-    # Apply the step function iteratively.
-    for i in range(steps + skip - 1):
-        x[i + 1, :] = step(x[i, :], rule_b)
-    return x[skip:]
+    with _trajectory_lock:
+        trajectory = get_trajectory(rule, size)
+        state = trajectory.state_at(skip)
+        if trajectory.modified and _checkpoint_cache is not None:
+            key = _trajectory_key(rule, size)
+            arrays = trajectory.to_arrays()
+            _checkpoint_cache.store(key, "trajectory", arrays)
+            trajectory.modified = False
+    return state
@@ -1,20 +1,20 @@
-from typing import List, Union
+from typing import Callable, Dict, Iterator, List, Optional, Union
 import logging
-import sys
+from collections import Counter
 from hashlib import md5
 
 import numpy as np
-from matplotlib import pyplot as plt
 
 from activations import (
-    trigger_sounds,
+    trigger_events,
     generate_activations,
 )
+from automata import iterate_combined_automaton
+from cache import RenderCache
+from noise import NOISE_SEED
+from sequence import LiveSequence, Mixer, Sequence
 
-logger = logging.getLogger()
-logger.setLevel(logging.INFO)
-handler = logging.StreamHandler(sys.stdout)
-logger.addHandler(handler)
+logger = logging.getLogger(__name__)
 
 SCALES = {
     "major": [0, 2, 4, 5, 7, 9, 11, 12],
@@ -24,13 +24,43 @@ SCALES = {
 
 POSSIBLE_RULES = [i for i in range(1, 255)]
 
+# number of samples per block when streaming (about 23 ms at 44.1 kHz)
+STREAM_BLOCK_SIZE = 1024
+
+# parameters that the memoized stages of an Automatone depend on; setting
+# one of them discards the stages that depend on it
+ACTIVATION_PARAMETERS = {"rules", "tone_range", "sequence_length", "skip"}
+FREQUENCY_PARAMETERS = {"tone_range", "scale", "root_frequency"}
+SEQUENCE_PARAMETERS = (
+    ACTIVATION_PARAMETERS
+    | FREQUENCY_PARAMETERS
+    | {
+        "interval",
+        "sequence_offset",
+        "attack_time",
+        "decay_time",
+        "sustain_time",
+        "sustain_level",
+        "release_time",
+        "pan",
+        "volume",
+        "wave",
+        "noise_ratio",
+    }
+)
+STAGE_PARAMETERS = {
+    "activations": ACTIVATION_PARAMETERS,
+    "frequencies": FREQUENCY_PARAMETERS,
+    "sequence": SEQUENCE_PARAMETERS,
+}
+
 
 class Automatone:
     def __init__(
         self,
         rules: Union[int, List[int]],
         tone_range: int,
-        sequence_length: int,
+        sequence_length: Optional[int],
         sequence_offset: int,
         skip: int,
         interval: float,
@@ -55,7 +85,8 @@ class Automatone:
             randomly chosen; if it is a list, we use the rules identified
             in the list.
         :param tone_range: range of tones to use in the 12-tone system
-        :param sequence_length: sequence length
+        :param sequence_length: sequence length, or None for an endless
+            Automatone, which can only be streamed (see stream)
         :param sequence_offset: number of time steps to skip from start
         :param skip: number of tones to skip from start of cellular automata
             calculation
@@ -63,7 +94,19 @@ class Automatone:
         :param tone_duration: tone duration in seconds
         :param scale: which musical scale to use. e.g. major, pentatonic
         :param root_frequency: frequency of the lowest note
+
+        The activations, frequencies and sequence are computed when they
+        are first used and then kept, until one of the parameters they
+        depend on is set (see STAGE_PARAMETERS). Parameters must be
+        replaced rather than modified in place (e.g. assign a new list of
+        rules instead of appending to it), or the change goes unnoticed.
+        The number of times each stage was reused or computed is counted
+        in cache_hits and cache_misses.
         """
+        self._stages = {}
+        self.cache_hits = Counter()
+        self.cache_misses = Counter()
+
         if type(rules) == int:
             self.seed = np.random.randint(0, 2**31)
             self.rules = np.random.choice(POSSIBLE_RULES, rules, replace=False)
@@ -88,12 +131,38 @@ class Automatone:
         self.wave = wave
         self.noise_ratio = noise_ratio
 
+    def __setattr__(self, name, value):
+        super().__setattr__(name, value)
+        stages = self.__dict__.get("_stages")
+        if stages:
+            for stage, parameters in STAGE_PARAMETERS.items():
+                if name in parameters:
+                    stages.pop(stage, None)
+
+    def _memoize(self, stage: str, compute: Callable):
+        """
+        Returns the value of a stage, computing it if it is not known.
+
+        :param stage: name of the stage, a key of STAGE_PARAMETERS
+        :param compute: function without arguments that computes the value
+        :return: value of the stage
+        """
+        if stage in self._stages:
+            self.cache_hits[stage] += 1
+            return self._stages[stage]
+
+        self.cache_misses[stage] += 1
+        result = compute()
+        self._stages[stage] = result
+        return result
+
     def __str__(self):
         params = (
             f"Selected rules: {self.rules}\n"
             f"Random seed: {self.seed}\n"
             f"Tone range: {self.tone_range}\n"
             f"Sequence length: {self.sequence_length}\n"
+            f"Sequence offset: {self.sequence_offset}\n"
             f"Skip: {self.skip}\n"
             f"Tone interval: {self.interval}\n"
             f"ADSLR: {self.attack_time}, {self.decay_time}, "
@@ -102,6 +171,7 @@ class Automatone:
             f"Scale: {self.scale}\n"
             f"Root frequency: {self.root_frequency}\n"
             f"Pan: {self.pan}\n"
+            f"Volume: {self.volume}\n"
             f"Wave: {self.wave}\n"
             f"Noise ratio: {self.noise_ratio}"
         )
@@ -113,18 +183,44 @@ class Automatone:
         m.update(bytes(self.__str__(), "utf-8"))
         return m.hexdigest()
 
+    @property
+    def activations_hash(self):
+        """
+        Hash of the parameters that determine the activations, which are
+        shared by Automatones that only differ in how they sound.
+        """
+        m = md5()
+        params = (
+            f"Selected rules: {self.rules}\n"
+            f"Tone range: {self.tone_range}\n"
+            f"Sequence length: {self.sequence_length}\n"
+            f"Skip: {self.skip}"
+        )
+        m.update(bytes(params, "utf-8"))
+        return m.hexdigest()
+
     @property
     def _activations(self):
+        return self._memoize("activations", self._compute_activations)
+
+    def _compute_activations(self):
+        if self.sequence_length is None:
+            raise ValueError("An endless Automatone can only be streamed")
         result = generate_activations(
             rules=self.rules,
             tone_range=self.tone_range,
             sequence_length=self.sequence_length,
             skip=self.skip,
         )
+        # shared between callers, so it must not be modified
+        result.flags.writeable = False
         return result
 
     @property
     def _frequencies(self):
+        return self._memoize("frequencies", self._compute_frequencies)
+
+    def _compute_frequencies(self):
         # TODO: include 'A4, A#4, B4 etc. notation'
         result = []
 
@@ -145,12 +241,14 @@ class Automatone:
 
         return result
 
-    @property
-    def _sequence(self):
-        result = trigger_sounds(
-            self._activations,
+    def _events(
+        self, activations: np.ndarray, first_step: int = 0
+    ) -> Dict[str, np.ndarray]:
+        # first_step is the time step of the first row of activations
+        result = trigger_events(
+            activations,
             interval=self.interval,
-            sequence_offset=self.sequence_offset,
+            sequence_offset=self.sequence_offset + first_step,
             attack_time=self.attack_time,
             decay_time=self.decay_time,
             sustain_time=self.sustain_time,
@@ -164,15 +262,189 @@ class Automatone:
         )
         return result
 
-    def render_audio(self, sample_rate: int, progress_bar: bool = False):
-        sequence = self._sequence
+    @property
+    def _sequence(self):
+        return self._memoize("sequence", self._compute_sequence)
+
+    def _compute_sequence(self):
+        result = Sequence()
+        result.add_events(self._events(self._activations))
+        return result
+
+    def cached_sequence(self, cache: RenderCache) -> Sequence:
+        """
+        Returns the sequence of the Automatone. If it is not memoized yet,
+        its event table is read from a render cache. On a miss, the event
+        table is computed from the activations, which are cached separately
+        (see activations_hash), and stored in the cache.
+
+        :param cache: render cache
+        :return: Sequence object
+        """
+        return self._memoize("sequence", lambda: self._load_sequence(cache))
+
+    def _load_sequence(self, cache: RenderCache) -> Sequence:
+        events = cache.load(self.hash, "events")
+        if events is None:
+            key = self.activations_hash
+            activations = self._stages.get("activations")
+            if activations is None:
+                activations = cache.load(key, "activations")
+            if activations is None:
+                activations = self._activations
+                cache.store(key, "activations", activations)
+            events = self._events(activations)
+            cache.store(self.hash, "events", events)
+
+        result = Sequence()
+        result.add_events(events)
+        return result
+
+    def render_audio(
+        self,
+        sample_rate: int,
+        progress_bar: bool = False,
+        dtype=np.float64,
+        workers: int = 1,
+        cache: Optional[RenderCache] = None,
+        snap_onsets: bool = False,
+        processes: bool = False,
+    ):
+        """
+        Renders the Automatone to a normalized stereo audio array.
+
+        :param sample_rate: sample rate in Hz
+        :param progress_bar: if True, show progress
+        :param dtype: floating point type used for rendering, e.g.
+            np.float32 to halve memory use
+        :param workers: number of threads used for rendering
+        :param cache: if given, return the audio from this render cache
+            if it was rendered before, and store it otherwise
+        :param snap_onsets: if True, round onsets to the nearest sample, so
+            that every note with the same template reuses it even if the
+            interval is not a whole number of samples (see
+            sequence.find_onsets)
+        :param processes: if True, render with processes instead of
+            threads (see Mixer.mix_parallel)
+        :return: n x 2 array with the left and right channel
+        """
+        if cache is None:
+            sequence = self._sequence
+        else:
+            name = f"audio-{sample_rate}-{np.dtype(dtype).name}"
+            if snap_onsets:
+                name += "-snapped"
+            au = cache.load(self.hash, name)
+            if au is not None:
+                return au
+            sequence = self.cached_sequence(cache)
+
         au = sequence.render(
             sample_rate=sample_rate,
             progress_bar=progress_bar,
+            snap_onsets=snap_onsets,
+            dtype=dtype,
+            workers=workers,
+            processes=processes,
         )
+        if cache is not None:
+            cache.store(self.hash, name, au)
         return au
 
+    def stream(
+        self,
+        sample_rate: int,
+        block_size: int = STREAM_BLOCK_SIZE,
+        gain: Optional[float] = None,
+        noise_seed: int = NOISE_SEED,
+        dtype=np.float32,
+        snap_onsets: bool = False,
+    ) -> Iterator[np.ndarray]:
+        """
+        Renders the Automatone as consecutive blocks of stereo audio,
+        computing each row of activations only when the block in which its
+        tones start is rendered (see automata.iterate_combined_automaton and
+        sequence.LiveSequence). The first block is ready almost
+        immediately, and memory use does not grow with the number of
+        blocks.
+
+        If sequence_length is None, the stream is endless. Otherwise it
+        stops when the last tone of the sequence has ended, and, divided by
+        the gain, the blocks equal Sequence.render without normalization.
+
+        Since the peak of the stream is not known in advance, the blocks
+        are scaled by a fixed gain, by default the inverse of peak_bound,
+        and clipped to [-1, 1].
+
+        :param sample_rate: sample rate in Hz
+        :param block_size: number of samples per block; the last block of
+            a finite stream may be shorter
+        :param gain: factor applied to every block; see above if None
+        :param noise_seed: seed of the noise bank
+        :param dtype: floating point type of the blocks
+        :param snap_onsets: if True, round onsets to the nearest sample
+            (see render_audio)
+        :return: iterator over block_size x 2 arrays
+        """
+        if gain is None:
+            peak = self.peak_bound(sample_rate)
+            gain = 1 / peak if peak > 0 else 1.0
+
+        rows = iterate_combined_automaton(
+            self.rules, size=self.tone_range, skip=self.skip
+        )
+        live = LiveSequence(
+            sample_rate,
+            snap_onsets=snap_onsets,
+            noise_seed=noise_seed,
+            dtype=dtype,
+        )
+        endless = self.sequence_length is None
+        step = 0
+        offset = 0
+        while True:
+            end = offset + block_size
+
+            # add the tones of all rows that start before the block ends
+            while endless or step < self.sequence_length:
+                start_time = self.interval * (step + self.sequence_offset)
+                if start_time * sample_rate >= end:
+                    break
+                activations = next(rows)[np.newaxis]
+                live.add_events(self._events(activations, first_step=step))
+                step += 1
+
+            if not endless and step >= self.sequence_length:
+                n = int(np.ceil(sample_rate * live.duration))
+                if offset >= n:
+                    return
+                end = min(end, n)
+
+            block = live.render(offset, end)
+            block *= gain
+            np.clip(block, -1, 1, out=block)
+            yield block
+            offset = end
+
+    def peak_bound(self, sample_rate: int) -> float:
+        """
+        Computes a bound on the peak of the audio of the Automatone for any
+        activations, from the tones that overlap when every activation is
+        on (see Mixer.peak_bound).
+
+        :param sample_rate: sample rate in Hz
+        :return: peak bound
+        """
+        duration = self.attack_time + self.decay_time + self.sustain_time
+        duration += self.release_time
+        rows = int(np.ceil(duration / self.interval)) + 1
+        activations = np.ones((rows, self.tone_range), dtype=np.int8)
+        return Mixer(self._events(activations), sample_rate).peak_bound()
+
     def render_graph(self):
+        # matplotlib is slow to import and only needed for plotting
+        from matplotlib import pyplot as plt
+
         fig, axes = plt.subplots(1, 1, figsize=(10, 6))
         img = self._activations.T
         freqs = [f"{freq:2.0f}" for freq in self._frequencies]
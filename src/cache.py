@@ -0,0 +1,150 @@
+import logging
+import os
+import uuid
+from typing import Dict, Optional, Union
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# default size limit of a render cache in bytes
+CACHE_SIZE = 2**30
+
+# value stored in a cache entry: an array, or a table of named arrays
+Entry = Union[np.ndarray, Dict[str, np.ndarray]]
+
+
+class RenderCache:
+    def __init__(self, root: str, max_bytes: int = CACHE_SIZE):
+        """
+        A RenderCache stores intermediate and final results of rendering on
+        disk, so that they do not have to be recomputed for parameters
+        that were rendered before. Entries are addressed by a key (a hash
+        of the parameters that determine them, e.g. Automatone.hash) and
+        a name (e.g. "events" or "audio-44100-float64"), and stored as
+        <root>/<key>/<name>.npy, or .npz for tables of arrays.
+
+        When the total size of the entries exceeds max_bytes, the least
+        recently used entries are removed. Reading an entry marks it as
+        used by updating its modification time.
+
+        :param root: directory of the cache
+        :param max_bytes: size limit of the cache in bytes
+        """
+        self.root = root
+        self.max_bytes = max_bytes
+        os.makedirs(root, exist_ok=True)
+
+    def _path(self, key: str, name: str, extension: str) -> str:
+        return os.path.join(self.root, key, f"{name}{extension}")
+
+    def load(self, key: str, name: str) -> Optional[Entry]:
+        """
+        Reads an entry from the cache.
+
+        :param key: key of the entry
+        :param name: name of the entry
+        :return: the stored array or table, or None if it is not cached
+        """
+        for extension in (".npy", ".npz"):
+            path = self._path(key, name, extension)
+            try:
+                with open(path, "rb") as f:
+                    value = np.load(f)
+                    if extension == ".npz":
+                        value = {k: value[k] for k in value.files}
+            except FileNotFoundError:
+                continue
+            except (OSError, ValueError) as e:
+                logger.warning(f"Ignoring unreadable cache entry {path}: {e}")
+                continue
+            try:
+                os.utime(path)
+            except FileNotFoundError:
+                pass
+            logger.debug(f"Cache hit: {key}/{name}")
+            return value
+
+        logger.debug(f"Cache miss: {key}/{name}")
+        return None
+
+    def store(self, key: str, name: str, value: Entry) -> None:
+        """
+        Writes an entry to the cache, replacing an existing entry with the
+        same key and name, and evicts entries if the cache is full. The
+        entry is written to a temporary file first, so that concurrent
+        readers never see a partial entry.
+
+        :param key: key of the entry
+        :param name: name of the entry
+        :param value: array, or dictionary of arrays
+        :return: None
+        """
+        directory = os.path.join(self.root, key)
+        os.makedirs(directory, exist_ok=True)
+        extension = ".npz" if isinstance(value, dict) else ".npy"
+
+        path = self._path(key, name, extension)
+        temp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        try:
+            with open(temp_path, "wb") as f:
+                if isinstance(value, dict):
+                    np.savez(f, **value)
+                else:
+                    np.save(f, np.asarray(value))
+            os.replace(temp_path, path)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+
+        self.evict()
+
+    def size(self) -> int:
+        """
+        :return: total size of the entries in bytes
+        """
+        return sum(os.path.getsize(path) for path in self._entries())
+
+    def evict(self) -> None:
+        """
+        Removes the least recently used entries until the total size of
+        the cache is at most max_bytes.
+
+        :return: None
+        """
+        entries = []
+        for path in self._entries():
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+            logger.debug(f"Evicted cache entry {path}")
+
+            # another process may store into the directory at any time
+            try:
+                os.rmdir(os.path.dirname(path))
+            except OSError:
+                pass
+
+    def _entries(self):
+        """
+        :return: iterator over the paths of all entries
+        """
+        for directory in os.scandir(self.root):
+            if not directory.is_dir():
+                continue
+            for entry in os.scandir(directory.path):
+                if entry.name.endswith((".npy", ".npz")):
+                    yield entry.path
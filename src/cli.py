@@ -1,55 +1,285 @@
+import csv
+import json
 import logging
+import os
 import sys
+import time
+from itertools import islice
+from typing import Dict, List, Optional, Tuple, Union
 
 import click
+import numpy as np
 
-from automatone import Automatone
+import automata
+import realtime
+from automatone import STREAM_BLOCK_SIZE, Automatone
 from audio import write_audio
+from cache import CACHE_SIZE, RenderCache
 
-logger = logging.getLogger()
-logger.setLevel(logging.INFO)
-handler = logging.StreamHandler(sys.stdout)
-logger.addHandler(handler)
+logger = logging.getLogger(__name__)
+
+# parameters of an Automatone that are not given, in the notation of the
+# generate command
+DEFAULTS = {
+    "rules": "[30]",
+    "tone_range": 24,
+    "sequence_length": 256,
+    "sequence_offset": 0,
+    "skip": 128,
+    "interval": 0.125,
+    "adslr": "0.01,0.02,0.03,0.5,0.04",
+    "scale": "pentatonic",
+    "root_frequency": 440,
+    "pan": 0.5,
+    "volume": 0.5,
+    "wave": "square",
+    "noise_ratio": 0.1,
+}
+
+
+# options of the commands that create an Automatone
+AUTOMATONE_OPTIONS = [
+    click.option(
+        "--rules",
+        default=DEFAULTS["rules"],
+        show_default=True,
+        help="""
+        Fundamental cellular automata rules to use.
+        If value is integer, randomly select that number of rules.
+        """,
+    ),
+    click.option(
+        "--tone-range",
+        default=DEFAULTS["tone_range"],
+        show_default=True,
+        help="Range of tones to use in the 12-tone system.",
+    ),
+    click.option(
+        "--sequence-length",
+        default=DEFAULTS["sequence_length"],
+        show_default=True,
+        help="Sequence length expressed in number of tones.",
+    ),
+    click.option(
+        "--sequence-offset",
+        default=DEFAULTS["sequence_offset"],
+        show_default=True,
+        help="Number of time steps to skip from start.",
+    ),
+    click.option(
+        "--skip",
+        default=DEFAULTS["skip"],
+        show_default=True,
+        help="Number of initial rows in cellular automata to skip.",
+    ),
+    click.option(
+        "--interval",
+        default=DEFAULTS["interval"],
+        show_default=True,
+        help="Interval between onsets of tones in seconds.",
+    ),
+    click.option(
+        "--adslr",
+        default=DEFAULTS["adslr"],
+        show_default=True,
+        help="adslr: (a)ttack, (d)ecay, (s)ustain, -(l)evel, "
+        "(r)release parameters. adsr in seconds, level between 0 and 1",
+    ),
+    click.option(
+        "--scale",
+        default=DEFAULTS["scale"],
+        show_default=True,
+        help="Which musical scale to use. e.g. major, pentatonic.",
+    ),
+    click.option(
+        "--root-frequency",
+        default=DEFAULTS["root_frequency"],
+        show_default=True,
+        help="frequency of the lowest note",
+    ),
+    click.option(
+        "--pan",
+        default=DEFAULTS["pan"],
+        show_default=True,
+        help="Stereo pan (0.0 = left, 0.5 = center, 1.0 = right)",
+    ),
+    click.option(
+        "--volume",
+        default=DEFAULTS["volume"],
+        show_default=True,
+        help="Relative volume. Can be any number",
+    ),
+]
+
+
+# option of the commands that render audio
+SNAP_ONSETS_OPTION = click.option(
+    "--snap-onsets/--exact-onsets",
+    default=False,
+    show_default=True,
+    help="Round note onsets to the nearest sample, so that notes with the "
+    "same sound are rendered once even if the interval is not a whole "
+    "number of samples. Onsets move by at most half a sample.",
+)
+
+
+def automatone_options(command):
+    """
+    Adds the options that define an Automatone (see AUTOMATONE_OPTIONS)
+    to a command.
+
+    :param command: command function
+    :return: command function with the options
+    """
+    for option in reversed(AUTOMATONE_OPTIONS):
+        command = option(command)
+    return command
 
 
 @click.group()
 def cli():
-    pass
+    # the CLI is the only place where logging is configured; modules only
+    # create loggers
+    logging.basicConfig(
+        level=logging.INFO, format="%(message)s", stream=sys.stdout
+    )
 
 
 @cli.command()
+@automatone_options
 @click.option(
-    "--rules",
-    default="[30]",
+    "--sample-rate",
+    default=96000,
     show_default=True,
-    help="""
-    Fundamental cellular automata rules to use.
-    If value is integer, randomly select that number of rules.
-    """,
+    help="Number of audio samples per second.",
 )
 @click.option(
-    "--tone-range",
-    default=24,
+    "--dtype",
+    type=click.Choice(["float64", "float32"]),
+    default="float64",
     show_default=True,
-    help="Range of tones to use in the 12-tone system.",
+    help="Floating point type used for rendering. "
+    "float32 halves memory use at slightly lower precision.",
 )
 @click.option(
-    "--sequence-length",
-    default=256,
+    "--workers",
+    default=1,
     show_default=True,
-    help="Sequence length expressed in number of tones.",
+    help="Number of threads or processes used for rendering.",
+)
+@click.option(
+    "--processes/--threads",
+    default=False,
+    show_default=True,
+    help="Render with a pool of processes or of threads. Threads share "
+    "memory, but only scale as far as numpy releases the GIL.",
+)
+@SNAP_ONSETS_OPTION
+@click.option(
+    "--cache-dir",
+    default=None,
+    help="Directory of a render cache. If given, results that were "
+    "rendered before, and checkpoints of skipped automaton steps, are read "
+    "from the cache instead of recomputed.",
+)
+@click.option(
+    "--cache-size",
+    default=CACHE_SIZE // 2**20,
+    show_default=True,
+    help="Size limit of the render cache in MiB.",
+)
+@click.option(
+    "--output-root",
+    default="/tmp/just-another-music-generator",
+    show_default=True,
+    help="Root of the output path.",
+)
+def generate(
+    rules: str,
+    tone_range: int,
+    sequence_length: int,
+    sequence_offset: int,
+    skip: int,
+    sample_rate: int,
+    interval: float,
+    adslr: str,
+    scale: str,
+    root_frequency: float,
+    pan: float,
+    volume: float,
+    dtype: str,
+    workers: int,
+    processes: bool,
+    snap_onsets: bool,
+    cache_dir: str,
+    cache_size: int,
+    output_root: str,
+):
+    """
+    Generates audio and saves to tmp file as Numpy array.
+    """
+
+    logger.info("generating Automatone object...")
+    automatone = create_automatone(
+        dict(
+            rules=rules,
+            tone_range=tone_range,
+            sequence_length=sequence_length,
+            sequence_offset=sequence_offset,
+            skip=skip,
+            interval=interval,
+            adslr=adslr,
+            scale=scale,
+            root_frequency=root_frequency,
+            pan=pan,
+            volume=volume,
+        )
+    )
+
+    cache = None
+    if cache_dir is not None:
+        cache = RenderCache(cache_dir, max_bytes=cache_size * 2**20)
+    automata.use_checkpoint_cache(cache)
+
+    logger.info(automatone.__str__())
+    au = automatone.render_audio(
+        sample_rate=sample_rate,
+        dtype=dtype,
+        workers=workers,
+        cache=cache,
+        snap_onsets=snap_onsets,
+        processes=processes,
+    )
+
+    logger.info(f"Write audio to file. Output dir: {output_root}")
+    logger.info(f"Hash: {automatone.hash}")
+
+    write_audio(au, sample_rate, output_root)
+
+
+@cli.command()
+@click.option(
+    "--parameters",
+    type=click.Path(exists=True, dir_okay=False),
+    help="""
+    JSONL or CSV file with one parameter set per line or row. Keys are the
+    options of the generate command (e.g. "tone_range", "adslr"), plus
+    "wave", "noise_ratio" and "seed". Missing keys take the defaults of the
+    generate command.
+    """,
 )
 @click.option(
-    "--sequence-offset",
+    "--seeds",
     default=0,
     show_default=True,
-    help="Number of time steps to skip from start.",
+    help="Number of parameter sets with random rules, one per seed, "
+    "used if no parameter file is given.",
 )
 @click.option(
-    "--skip",
-    default=128,
+    "--rules",
+    default=3,
     show_default=True,
-    help="Number of initial rows in cellular automata to skip.",
+    help="Number of random rules per seed (see --seeds).",
 )
 @click.option(
     "--sample-rate",
@@ -58,98 +288,380 @@ def cli():
     help="Number of audio samples per second.",
 )
 @click.option(
-    "--interval",
-    default=0.125,
+    "--dtype",
+    type=click.Choice(["float64", "float32"]),
+    default="float64",
+    show_default=True,
+    help="Floating point type used for rendering.",
+)
+@click.option(
+    "--workers",
+    default=os.cpu_count(),
     show_default=True,
-    help="Interval between onsets of tones in seconds.",
+    help="Number of processes that render parameter sets concurrently.",
 )
+@SNAP_ONSETS_OPTION
 @click.option(
-    "--adslr",
-    default="0.01,0.02,0.03,0.5,0.04",
+    "--cache-dir",
+    default=None,
+    help="Directory of a render cache, shared by the workers.",
+)
+@click.option(
+    "--cache-size",
+    default=CACHE_SIZE // 2**20,
     show_default=True,
-    help="adslr: (a)ttack, (d)ecay, (s)ustain, -(l)evel, "
-    "(r)release parameters. adsr in seconds, level between 0 and 1",
+    help="Size limit of the render cache in MiB.",
 )
 @click.option(
-    "--scale",
-    default="pentatonic",
+    "--output-root",
+    default="/tmp/just-another-music-generator",
     show_default=True,
-    help="Which musical scale to use. e.g. major, pentatonic.",
+    help="Root of the output path. Each result is written to "
+    "<output-root>/<hash>/audio.wav.",
 )
+def batch(
+    parameters: str,
+    seeds: int,
+    rules: int,
+    sample_rate: int,
+    dtype: str,
+    workers: int,
+    snap_onsets: bool,
+    cache_dir: str,
+    cache_size: int,
+    output_root: str,
+):
+    """
+    Generates audio for many parameter sets in a pool of processes.
+    """
+    if parameters is not None:
+        parameter_sets = read_parameter_sets(parameters)
+    else:
+        parameter_sets = [
+            {"seed": seed, "rules": rules} for seed in range(seeds)
+        ]
+    if not parameter_sets:
+        raise click.UsageError("Give a parameter file or a number of seeds.")
+
+    os.makedirs(output_root, exist_ok=True)
+    logger.info(
+        f"Rendering {len(parameter_sets)} parameter sets "
+        f"with {workers} workers..."
+    )
+
+    # multiprocessing is slow to import and only needed here
+    from concurrent.futures import ProcessPoolExecutor, as_completed
+
+    start = time.perf_counter()
+    invalid = 0
+    duplicates = 0
+    failed = 0
+    rendered = 0
+
+    # parameter sets are resolved here, so that random rules are drawn
+    # once, and sets with the same hash, which would write the same output
+    # file, are only rendered once
+    automatones = {}
+    for i, params in enumerate(parameter_sets):
+        try:
+            automatone = create_automatone(params)
+        except Exception as e:
+            invalid += 1
+            logger.error(f"Parameter set {i} is invalid: {e}")
+            continue
+        if automatone.hash in automatones:
+            first, _ = automatones[automatone.hash]
+            logger.warning(
+                f"Parameter set {i} is a duplicate of parameter set "
+                f"{first} ({automatone.hash}), skipping it"
+            )
+            duplicates += 1
+            continue
+        automatones[automatone.hash] = (i, automatone)
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {
+            executor.submit(
+                render_automatone,
+                automatone,
+                sample_rate,
+                dtype,
+                output_root,
+                cache_dir,
+                cache_size * 2**20,
+                snap_onsets,
+            ): i
+            for i, automatone in automatones.values()
+        }
+        for future in as_completed(futures):
+            i = futures[future]
+            try:
+                hash_, seconds = future.result()
+            except Exception as e:
+                failed += 1
+                logger.error(f"Parameter set {i} failed: {e}")
+                continue
+            rendered += 1
+            logger.info(f"Parameter set {i}: {hash_} in {seconds:.2f} s")
+
+    elapsed = time.perf_counter() - start
+    logger.info(
+        f"Rendered {rendered} of {len(parameter_sets)} parameter sets in "
+        f"{elapsed:.2f} s: {duplicates} duplicates, {invalid} invalid, "
+        f"{failed} failed to render"
+    )
+    if invalid or failed:
+        sys.exit(1)
+
+
+@cli.command()
+@automatone_options
 @click.option(
-    "--root-frequency",
-    default=440,
+    "--sample-rate",
+    default=44100,
     show_default=True,
-    help="frequency of the lowest note",
+    help="Number of audio samples per second.",
 )
 @click.option(
-    "--pan",
-    default=0.5,
+    "--block-size",
+    default=STREAM_BLOCK_SIZE,
     show_default=True,
-    help="Stereo pan (0.0 = left, 0.5 = center, 1.0 = right)",
+    help="Number of samples per block.",
 )
 @click.option(
-    "--volume",
-    default=0.5,
+    "--lookahead",
+    default=realtime.LOOKAHEAD,
     show_default=True,
-    help="Relative volume. Can be any number",
+    help="Number of blocks rendered ahead of playback. "
+    "Latency is lookahead x block size / sample rate.",
 )
 @click.option(
-    "--output-root",
-    default="/tmp/just-another-music-generator",
+    "--sink",
+    type=click.Choice(["null", "pipe", "device"]),
+    default="null",
     show_default=True,
-    help="Root of the output path.",
+    help="Where blocks go: discarded (null), raw 16-bit samples on "
+    "stdout (pipe), or the sound device (device, needs sounddevice).",
 )
-def generate(
+@click.option(
+    "--gain",
+    type=float,
+    default=None,
+    help="Gain applied to the audio. By default, the gain is chosen so "
+    "that the audio never clips.",
+)
+@click.option(
+    "--endless",
+    is_flag=True,
+    help="Ignore the sequence length and play until interrupted.",
+)
+@click.option(
+    "--duration",
+    type=float,
+    default=None,
+    help="Stop after this number of seconds.",
+)
+@click.option(
+    "--realtime/--no-realtime",
+    "paced",
+    default=True,
+    show_default=True,
+    help="Pace rendering by the playback clock, or render as fast as "
+    "possible.",
+)
+@SNAP_ONSETS_OPTION
+def stream(
     rules: str,
     tone_range: int,
     sequence_length: int,
     sequence_offset: int,
     skip: int,
-    sample_rate: int,
     interval: float,
     adslr: str,
     scale: str,
     root_frequency: float,
     pan: float,
     volume: float,
-    output_root: str,
+    sample_rate: int,
+    block_size: int,
+    lookahead: int,
+    sink: str,
+    gain: Optional[float],
+    endless: bool,
+    duration: Optional[float],
+    paced: bool,
+    snap_onsets: bool,
 ):
     """
-    Generates audio and saves to tmp file as Numpy array.
+    Plays audio while it is generated, and reports blocks that missed
+    their deadline.
     """
+    if sink == "pipe":
+        # stdout carries the audio
+        logging.basicConfig(
+            level=logging.INFO,
+            format="%(message)s",
+            stream=sys.stderr,
+            force=True,
+        )
 
-    logger.info("generating Automatone object...")
-    rules = parse_rules(rules)
-    adslr = parse_adslr(adslr)
-
-    automatone = Automatone(
-        rules=rules,
-        tone_range=tone_range,
-        sequence_length=sequence_length,
-        sequence_offset=sequence_offset,
-        skip=skip,
-        interval=interval,
+    automatone = create_automatone(
+        dict(
+            rules=rules,
+            tone_range=tone_range,
+            sequence_length=sequence_length,
+            sequence_offset=sequence_offset,
+            skip=skip,
+            interval=interval,
+            adslr=adslr,
+            scale=scale,
+            root_frequency=root_frequency,
+            pan=pan,
+            volume=volume,
+        )
+    )
+    if endless:
+        automatone.sequence_length = None
+    logger.info(automatone.__str__())
+
+    blocks = automatone.stream(
+        sample_rate,
+        block_size=block_size,
+        gain=gain,
+        snap_onsets=snap_onsets,
+    )
+    if duration is not None:
+        blocks = islice(
+            blocks, int(np.ceil(duration * sample_rate / block_size))
+        )
+    if sink == "null":
+        output = realtime.NullSink()
+    elif sink == "pipe":
+        output = realtime.PipeSink()
+    else:
+        try:
+            output = realtime.DeviceSink(sample_rate, block_size=block_size)
+        except ImportError as e:
+            raise click.ClickException(str(e))
+
+    with output:
+        stats = realtime.stream(
+            blocks,
+            output,
+            sample_rate,
+            block_size,
+            lookahead=lookahead,
+            realtime=paced,
+        )
+    logger.info(stats.__str__())
+
+
+def read_parameter_sets(path: str) -> List[Dict]:
+    """
+    Reads parameter sets from a JSONL file (one JSON object per line) or,
+    if the file name ends with .csv, from a CSV file with a header row.
+    Empty values are left out, so that they take their defaults.
+
+    :param path: path of the file
+    :return: list of parameter sets
+    """
+    with open(path, newline="") as f:
+        if path.lower().endswith(".csv"):
+            rows = list(csv.DictReader(f))
+            return [{k: v for k, v in row.items() if v != ""} for row in rows]
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def create_automatone(params: Dict) -> Automatone:
+    """
+    Creates an Automatone from a parameter set. Values may be strings, as
+    read from a CSV file or given on the command line; they are parsed like
+    the options of the generate command. If "rules" is an integer, that
+    number of rules is chosen at random. If the parameter set has a "seed",
+    the random generator is seeded with it first, so that random rules are
+    reproducible.
+
+    :param params: parameters in the notation of the generate command
+    :return: Automatone object
+    """
+    unknown = set(params) - set(DEFAULTS) - {"seed"}
+    if unknown:
+        raise ValueError(f"Unknown parameters: {sorted(unknown)}")
+
+    values = {}
+    for key, default in DEFAULTS.items():
+        value = params.get(key, default)
+        if key == "rules":
+            if isinstance(value, str):
+                value = parse_rules(value)
+        elif key == "adslr":
+            if isinstance(value, str):
+                value = parse_adslr(value)
+        elif isinstance(value, str) and not isinstance(default, str):
+            value = parse_number(value)
+        values[key] = value
+
+    if "seed" in params:
+        np.random.seed(int(params["seed"]))
+
+    adslr = values.pop("adslr")
+    return Automatone(
         attack_time=adslr[0],
         decay_time=adslr[1],
         sustain_time=adslr[2],
         sustain_level=adslr[3],
         release_time=adslr[4],
-        scale=scale,
-        root_frequency=root_frequency,
-        pan=pan,
-        volume=volume,
-        wave="square",
-        noise_ratio=0.1,
+        **values,
     )
 
-    logger.info(automatone.__str__())
-    au = automatone.render_audio(sample_rate=sample_rate)
 
-    logger.info(f"Write audio to file. Output dir: {output_root}")
-    logger.info(f"Hash: {automatone.hash}")
+def render_automatone(
+    automatone: Automatone,
+    sample_rate: int,
+    dtype: str,
+    output_root: str,
+    cache_dir: Optional[str] = None,
+    cache_size: int = CACHE_SIZE,
+    snap_onsets: bool = False,
+) -> Tuple[str, float]:
+    """
+    Renders an Automatone and writes it to <output_root>/<hash>.
 
-    write_audio(au, sample_rate, output_root)
+    :param automatone: Automatone object
+    :param sample_rate: number of audio samples per second
+    :param dtype: floating point type used for rendering
+    :param output_root: root of the output path
+    :param cache_dir: directory of a render cache, if any
+    :param cache_size: size limit of the render cache in bytes
+    :param snap_onsets: if True, round onsets to the nearest sample
+    :return: hash of the Automatone and the time taken in seconds
+    """
+    start = time.perf_counter()
+    cache = None
+    if cache_dir is not None:
+        cache = RenderCache(cache_dir, max_bytes=cache_size)
+    automata.use_checkpoint_cache(cache)
+    au = automatone.render_audio(
+        sample_rate=sample_rate,
+        dtype=dtype,
+        cache=cache,
+        snap_onsets=snap_onsets,
+    )
+    write_audio(au, sample_rate, os.path.join(output_root, automatone.hash))
+    return automatone.hash, time.perf_counter() - start
+
+
+def parse_number(string: str) -> Union[int, float]:
+    """
+    Parses a number, which stays an integer if it has no decimals.
+
+    :param string: number as text
+    :return: integer or float
+    """
+    try:
+        return int(string)
+    except ValueError:
+        return float(string)
 
 
 def parse_rules(rules):
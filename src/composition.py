@@ -1,26 +1,214 @@
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from hashlib import md5
+from typing import Dict, Optional, Tuple
+
 import numpy as np
-from matplotlib import pyplot as plt
 
 from automatone import Automatone
+from cache import RenderCache
 from sequence import Sequence
 
+logger = logging.getLogger(__name__)
+
 
 class Composition:
     def __init__(self):
         self.automatones = []
+        # rendered tracks by automatone hash, sample rate and cache name
+        self._stems: Dict[Tuple[str, int, str], np.ndarray] = {}
 
     def add(self, automatone: Automatone):
         self.automatones.append(automatone)
 
-    def render_audio(self, sample_rate, normalize):
-        sequence = Sequence()
+    def render_audio(
+        self,
+        sample_rate,
+        normalize,
+        target: Optional[str] = None,
+        target_dtype: str = "float32",
+        dtype=np.float64,
+        workers: int = 1,
+        cache: Optional[RenderCache] = None,
+        snap_onsets: bool = False,
+        processes: bool = False,
+    ):
+        """
+        Renders all automatones into one stereo audio array.
+
+        Each automatone is rendered as a separate track, with its own event
+        table, template cache and noise key (see noise_key and
+        Sequence.render), and the tracks are
+        summed into a mix bus of the given dtype, which is normalized
+        afterwards. With more than one worker, tracks are rendered in a
+        pool of threads, or of processes, which scale better since mixing
+        holds the GIL for much of the time (see Mixer.mix_parallel). The
+        time taken per track is logged.
+
+        Rendered tracks (stems) are kept per automatone hash, and stored in
+        the render cache if one is given, so after an automatone is
+        changed, added or replaced, only its track is rendered again and
+        the others are only mixed.
+
+        :param sample_rate: sample rate in Hz
+        :param normalize: if True, scale the result to a peak of 1
+        :param target: if given, render into a memory-mapped WAV file at
+            this path (see Sequence.render_to_wav)
+        :param target_dtype: sample type of the target file, "float32"
+            or "int32"
+        :param dtype: floating point type used for rendering in memory
+        :param workers: number of threads or processes used for rendering
+        :param cache: if given, read the event tables of the automatones
+            from this render cache, and return the audio from the cache
+            if it was rendered before (not used for the audio if a target
+            is given)
+        :param snap_onsets: if True, round onsets to the nearest sample
+            (see Automatone.render_audio)
+        :param processes: if True, the workers are processes instead of
+            threads
+        :return: n x 2 array with the left and right channel
+        """
+        if target is not None:
+            sequence = Sequence()
+            noise_keys, lengths = [], []
+            for automatone in self.automatones:
+                if cache is None:
+                    track = automatone._sequence
+                else:
+                    track = automatone.cached_sequence(cache)
+                sequence.add(track)
+                noise_keys.append(noise_key(automatone))
+                lengths.append(len(track))
+
+            return sequence.render(
+                sample_rate=sample_rate,
+                normalize=normalize,
+                target=target,
+                target_dtype=target_dtype,
+                snap_onsets=snap_onsets,
+                noise_key=np.repeat(
+                    np.array(noise_keys, dtype=np.uint64), lengths
+                ),
+                workers=workers,
+                processes=processes,
+            )
+
+        if cache is not None:
+            name = f"audio-{sample_rate}-{np.dtype(dtype).name}"
+            if not normalize:
+                name += "-unnormalized"
+            if snap_onsets:
+                name += "-snapped"
+            audio = cache.load(self.hash, name)
+            if audio is not None:
+                return audio
+
+        # render the tracks whose stems are not known yet, once per stem
+        missing = {}
         for automatone in self.automatones:
-            sequence.add(automatone._sequence.sequence)
+            key = stem_key(automatone, sample_rate, dtype, snap_onsets)
+            if key not in self._stems:
+                missing[key] = automatone
+        arguments = [
+            (automatone, sample_rate, dtype, cache, snap_onsets)
+            for automatone in missing.values()
+        ]
+        if workers > 1 and len(missing) > 1:
+            if processes:
+                # multiprocessing is slow to import and only needed here
+                from concurrent.futures import ProcessPoolExecutor
 
-        audio = sequence.render(sample_rate=sample_rate, normalize=normalize)
+                executor = ProcessPoolExecutor(max_workers=workers)
+            else:
+                executor = ThreadPoolExecutor(max_workers=workers)
+            with executor:
+                results = list(executor.map(timed_stem, *zip(*arguments)))
+        else:
+            results = [timed_stem(*args) for args in arguments]
+
+        render_times = {}
+        for key, (stem, seconds) in zip(missing, results):
+            stem.flags.writeable = False
+            self._stems[key] = stem
+            render_times[key] = seconds
+
+        tracks = []
+        for automatone in self.automatones:
+            key = stem_key(automatone, sample_rate, dtype, snap_onsets)
+            tracks.append((self._stems[key], render_times.pop(key, 0.0)))
+
+        # forget the stems of automatones that are no longer in the
+        # composition or have been changed
+        hashes = {automatone.hash for automatone in self.automatones}
+        for key in list(self._stems):
+            if key[0] not in hashes:
+                del self._stems[key]
+
+        # the mix bus is as long as the longest track (like an empty
+        # sequence, an empty composition lasts 1 second)
+        n = max([len(track) for track, _ in tracks], default=sample_rate)
+        audio = np.zeros((n, 2), dtype=dtype)
+        for i, (track, seconds) in enumerate(tracks):
+            audio[: len(track)] += track
+            logger.info(
+                f"Track {i} ({self.automatones[i].hash[:8]}): "
+                f"{len(track) / sample_rate:.1f} s of audio "
+                f"in {seconds:.2f} s"
+            )
+
+        if normalize:
+            absmax = np.max(np.abs(audio))
+            audio /= absmax
+
+        if cache is not None:
+            cache.store(self.hash, name, audio)
         return audio
 
+    def render_track(
+        self,
+        automatone: Automatone,
+        sample_rate: int,
+        dtype=np.float64,
+        cache: Optional[RenderCache] = None,
+        snap_onsets: bool = False,
+    ) -> np.ndarray:
+        """
+        Renders one automatone of the composition without normalization,
+        unless its track was rendered before with the same parameters.
+
+        :param automatone: Automatone object
+        :param sample_rate: sample rate in Hz
+        :param dtype: floating point type used for rendering
+        :param cache: if given, read the event table and the track of the
+            automatone from this render cache, and store the track if it
+            was not cached
+        :param snap_onsets: if True, round onsets to the nearest sample
+        :return: read-only n x 2 array with the left and right channel
+        """
+        key = stem_key(automatone, sample_rate, dtype, snap_onsets)
+        stem = self._stems.get(key)
+        if stem is None:
+            stem = render_stem(
+                automatone, sample_rate, dtype, cache, snap_onsets
+            )
+            stem.flags.writeable = False
+            self._stems[key] = stem
+        return stem
+
+    @property
+    def hash(self):
+        """
+        Hash of the automatones in the composition, in order.
+        """
+        m = md5()
+        for automatone in self.automatones:
+            m.update(bytes(automatone.hash, "utf-8"))
+        return m.hexdigest()
+
     def activations_per_automatone(self):
+        from matplotlib import pyplot as plt
+
         n = len(self.automatones)
         fig, axes = plt.subplots(n, 1)
         for i, automatone in enumerate(self.automatones):
@@ -41,3 +229,80 @@ class Composition:
 
         result = np.concatenate(new_activations, axis=0)
         return result
+
+
+def noise_key(automatone: Automatone) -> int:
+    """
+    Derives the key with which the tones of an automatone read noise in a
+    composition (see noise.NoiseBank.offsets), so that tracks that play
+    the same pitch at the same time and pan get independent noise.
+
+    :param automatone: Automatone object
+    :return: non-negative integer below 2**60
+    """
+    return int(automatone.hash[:15], 16)
+
+
+def stem_key(
+    automatone: Automatone, sample_rate: int, dtype, snap_onsets: bool
+) -> Tuple[str, int, str]:
+    """
+    :return: automatone hash, sample rate and cache name of the rendered
+        track of an automatone (see render_stem)
+    """
+    name = f"stem-{sample_rate}-{np.dtype(dtype).name}"
+    if snap_onsets:
+        name += "-snapped"
+    return automatone.hash, sample_rate, name
+
+
+def render_stem(
+    automatone: Automatone,
+    sample_rate: int,
+    dtype=np.float64,
+    cache: Optional[RenderCache] = None,
+    snap_onsets: bool = False,
+) -> np.ndarray:
+    """
+    Renders the track of an automatone in a composition without
+    normalization, with its own noise key (see noise_key).
+
+    :param automatone: Automatone object
+    :param sample_rate: sample rate in Hz
+    :param dtype: floating point type used for rendering
+    :param cache: if given, read the event table and the track of the
+        automatone from this render cache, and store the track if it was
+        not cached
+    :param snap_onsets: if True, round onsets to the nearest sample
+    :return: n x 2 array with the left and right channel
+    """
+    hash_, _, name = stem_key(automatone, sample_rate, dtype, snap_onsets)
+    if cache is not None:
+        stem = cache.load(hash_, name)
+        if stem is not None:
+            return stem
+        sequence = automatone.cached_sequence(cache)
+    else:
+        sequence = automatone._sequence
+
+    stem = sequence.render(
+        sample_rate=sample_rate,
+        normalize=False,
+        snap_onsets=snap_onsets,
+        noise_key=noise_key(automatone),
+        dtype=dtype,
+    )
+    if cache is not None:
+        cache.store(hash_, name, stem)
+    return stem
+
+
+def timed_stem(*args) -> Tuple[np.ndarray, float]:
+    """
+    Renders a track like render_stem, which takes the same arguments.
+
+    :return: the track and the time taken in seconds
+    """
+    start = time.perf_counter()
+    stem = render_stem(*args)
+    return stem, time.perf_counter() - start
@@ -0,0 +1,97 @@
+from functools import lru_cache
+
+import numpy as np
+
+# number of samples in a noise bank (about 11 seconds at 96 kHz)
+NOISE_BANK_SIZE = 2**20
+
+# default seed of the noise bank
+NOISE_SEED = 0
+
+# multipliers used to hash event fields into noise offsets
+HASH_MULTIPLIERS = (
+    np.uint64(0x9E3779B97F4A7C15),
+    np.uint64(0xBF58476D1CE4E5B9),
+    np.uint64(0x94D049BB133111EB),
+)
+
+
+class NoiseBank:
+    def __init__(self, size: int = NOISE_BANK_SIZE, seed: int = NOISE_SEED):
+        """
+        A NoiseBank holds precomputed standard normal noise, which tones
+        read at pseudo-random offsets instead of sampling new noise for
+        every tone. The offsets are derived from the tones themselves
+        (see offsets), so rendering is reproducible for a given seed and
+        does not depend on the order in which tones are rendered.
+
+        :param size: number of noise samples
+        :param seed: seed of the random generator
+        """
+        self.seed = seed
+        rng = np.random.default_rng(seed)
+        self.noise = rng.standard_normal(size, dtype=np.float32)
+        self.peak = float(np.max(np.abs(self.noise)))
+
+    def __len__(self):
+        return len(self.noise)
+
+    def offsets(self, start_times, pitches, pans, keys=0) -> np.ndarray:
+        """
+        Computes the offset at which each tone starts reading noise, by
+        hashing its start time, pitch and pan together with the seed and
+        a key.
+
+        Tones with the same start time, pitch and pan and the same key
+        read the same noise. Tones of different tracks (see
+        Composition.render_audio) get different keys, so that their noise
+        adds up like independent noise instead of coherently.
+
+        :param start_times: start times of the tones
+        :param pitches: pitches of the tones
+        :param pans: pans of the tones
+        :param keys: non-negative integer key of each tone, or one key
+            for all tones; key 0 gives the same offsets as no key
+        :return: array of offsets between 0 and len(self)
+        """
+        fields = [
+            np.asarray(value, dtype=np.float64).view(np.uint64)
+            for value in (start_times, pitches, pans)
+        ]
+        keys = np.asarray(keys, dtype=np.uint64)
+        # the hash relies on uint64 arithmetic wrapping around, which
+        # numpy reports as an overflow for scalars
+        with np.errstate(over="ignore"):
+            h = np.full(fields[0].shape, self.seed, dtype=np.uint64)
+            h = h ^ (keys * HASH_MULTIPLIERS[-1])
+            for field, multiplier in zip(fields, HASH_MULTIPLIERS):
+                h = (h ^ field) * multiplier
+                h ^= h >> np.uint64(31)
+        return (h % np.uint64(len(self))).astype(np.int64)
+
+    def read(self, offset: int, n: int) -> np.ndarray:
+        """
+        Reads n noise samples, starting at the given offset and wrapping
+        around the end of the bank.
+
+        :param offset: index of the first sample; may exceed len(self)
+        :param n: number of samples
+        :return: array of n noise samples
+        """
+        start = offset % len(self)
+        end = start + n
+        if end <= len(self):
+            return self.noise[start:end]
+        return np.take(self.noise, np.arange(start, end), mode="wrap")
+
+
+@lru_cache(maxsize=8)
+def get_noise_bank(seed: int = NOISE_SEED) -> NoiseBank:
+    """
+    Returns the shared noise bank for a seed, creating it when it is
+    first used.
+
+    :param seed: seed of the random generator
+    :return: NoiseBank object
+    """
+    return NoiseBank(seed=seed)
@@ -0,0 +1,137 @@
+from functools import lru_cache
+from typing import Optional, Union
+
+import numpy as np
+
+# supported wave types; the position in this list is the wave id
+WAVES = ["sin", "square", "saw", "triangle"]
+
+# wave id of the sine wave
+SIN = WAVES.index("sin")
+
+# number of samples in one period of a wavetable (a power of 2)
+TABLE_SIZE = 4096
+
+# largest number of harmonics that fits in a wavetable
+MAX_HARMONICS = TABLE_SIZE // 2 - 1
+
+
+def wave_id(wave: Union[str, int]) -> int:
+    """
+    Converts the name of a wave type into its wave id.
+
+    :param wave: type of soundwave, e.g. "sin" or "square", or a wave id
+    :return: index of the wave type in WAVES
+    """
+    if isinstance(wave, (int, np.integer)):
+        if 0 <= wave < len(WAVES):
+            return int(wave)
+        raise NotImplementedError(f"Wave id {wave} not implemented")
+    try:
+        return WAVES.index(wave)
+    except ValueError:
+        raise NotImplementedError(f"Wave {wave} not implemented")
+
+
+def harmonic_amplitudes(wave: int, n_harmonics: int) -> np.ndarray:
+    """
+    Calculates the amplitudes of the sine harmonics that make up a wave,
+    up to the given number of harmonics.
+
+    :param wave: wave id
+    :param n_harmonics: number of harmonics
+    :return: array with the amplitude of harmonic k at index k
+    """
+    k = np.arange(n_harmonics + 1, dtype=np.float64)
+    amplitudes = np.zeros(n_harmonics + 1)
+    odd = k % 2 == 1
+
+    if WAVES[wave] == "sin":
+        amplitudes[1] = 1.0
+    elif WAVES[wave] == "square":
+        amplitudes[odd] = 4 / (np.pi * k[odd])
+    elif WAVES[wave] == "saw":
+        sign = np.where(odd, 1.0, -1.0)
+        amplitudes[1:] = 2 / (np.pi * k[1:]) * sign[1:]
+    elif WAVES[wave] == "triangle":
+        sign = np.where(k % 4 == 1, 1.0, -1.0)
+        amplitudes[odd] = 8 / (np.pi * k[odd]) ** 2 * sign[odd]
+    else:
+        raise NotImplementedError
+    return amplitudes
+
+
+@lru_cache(maxsize=128)
+def wavetable(wave: int, n_harmonics: int) -> np.ndarray:
+    """
+    Creates a band-limited wavetable: one period of the wave, built from
+    its first n_harmonics sine harmonics and scaled to a peak of 1. The
+    table continues with the first two samples of the next period, so that
+    it can be interpolated without wrapping around.
+
+    :param wave: wave id
+    :param n_harmonics: number of harmonics, at most MAX_HARMONICS
+    :return: read-only array of TABLE_SIZE + 2 samples
+    """
+    n_harmonics = max(1, min(n_harmonics, MAX_HARMONICS))
+    amplitudes = harmonic_amplitudes(wave, n_harmonics)
+
+    # a sine harmonic of amplitude a is an imaginary Fourier coefficient
+    spectrum = np.zeros(TABLE_SIZE // 2 + 1, dtype=np.complex128)
+    spectrum[: n_harmonics + 1] = -0.5j * TABLE_SIZE * amplitudes
+    table = np.fft.irfft(spectrum, n=TABLE_SIZE)
+    table /= np.max(np.abs(table))
+
+    table = np.append(table, table[:2])
+    table.flags.writeable = False
+    return table
+
+
+def oscillate(
+    wave: int,
+    u: np.ndarray,
+    pitch: float,
+    sample_rate: Optional[float] = None,
+    dtype=np.float64,
+) -> np.ndarray:
+    """
+    Evaluates a wave at given time stamps. Sine waves use np.sin directly;
+    other waves read a band-limited wavetable with a phase accumulator and
+    linear interpolation. Only harmonics below the Nyquist frequency are
+    included, so the wave does not alias.
+
+    :param wave: wave id
+    :param u: time stamps in seconds, relative to the start of the wave
+    :param pitch: frequency in Hertz
+    :param sample_rate: sample rate in Hz, which determines the number of
+        harmonics; if None, it is derived from the spacing of u
+    :param dtype: floating point type of the result. Phases are always
+        evaluated in double precision.
+    :return: wave value for each time stamp, between -1 and 1
+    """
+    if wave == SIN:
+        phase = np.multiply(u, 2 * np.pi * pitch, dtype=np.float64)
+        return np.sin(phase, out=np.empty(phase.shape, dtype=dtype))
+
+    if sample_rate is None:
+        sample_rate = 1 / (u[1] - u[0]) if len(u) > 1 else np.inf
+    if pitch > 0 and np.isfinite(sample_rate):
+        n_harmonics = int(sample_rate / 2 / pitch)
+    else:
+        n_harmonics = MAX_HARMONICS
+    table = wavetable(wave, n_harmonics)
+
+    # phase in table samples: integer part indexes the table (wrapped to
+    # one period), fractional part interpolates between samples
+    position = np.multiply(u, pitch * TABLE_SIZE, dtype=np.float64)
+    index = position.astype(np.int64)
+    position -= index
+    index &= TABLE_SIZE - 1
+
+    lower = np.take(table, index)
+    index += 1
+    upper = np.take(table, index)
+    upper -= lower
+    position *= upper
+    position += lower
+    return position.astype(dtype, copy=False)
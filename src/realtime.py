@@ -0,0 +1,271 @@
+import logging
+import sys
+import time
+from typing import BinaryIO, Callable, Iterable, Optional
+
+import numpy as np
+
+from automatone import STREAM_BLOCK_SIZE
+
+logger = logging.getLogger(__name__)
+
+# number of blocks that are rendered ahead of the consumer
+LOOKAHEAD = 4
+
+# sample types that a PipeSink can write
+PIPE_DTYPES = {"int16": "<i2", "float32": "<f4"}
+
+
+class StreamStats:
+    def __init__(self, block_duration: float):
+        """
+        StreamStats collects the render times and deadline misses of the
+        blocks of a stream (see stream). Only running totals are kept.
+
+        :param block_duration: duration of a block in seconds
+        """
+        self.block_duration = block_duration
+        self.blocks = 0
+        self.misses = 0
+        self.max_lateness = 0.0
+        self.total_render_time = 0.0
+        self.max_render_time = 0.0
+        # buffer underflows reported by the sink, see DeviceSink
+        self.underflows = 0
+
+    def add(self, render_time: float, lateness: float) -> None:
+        """
+        Records a block.
+
+        :param render_time: time taken to render the block in seconds
+        :param lateness: time by which the block missed its deadline in
+            seconds; negative if it was in time
+        :return: None
+        """
+        self.blocks += 1
+        self.total_render_time += render_time
+        self.max_render_time = max(self.max_render_time, render_time)
+        if lateness > 0:
+            self.misses += 1
+            self.max_lateness = max(self.max_lateness, lateness)
+
+    @property
+    def load(self) -> float:
+        """
+        Mean render time of a block as a fraction of its duration.
+        """
+        if self.blocks == 0:
+            return 0.0
+        return self.total_render_time / self.blocks / self.block_duration
+
+    def __str__(self):
+        mean = self.total_render_time / max(self.blocks, 1)
+        return (
+            f"{self.blocks} blocks of {self.block_duration * 1000:.1f} ms, "
+            f"{self.misses} deadline misses "
+            f"(worst {self.max_lateness * 1000:.1f} ms late), "
+            f"render time mean {mean * 1000:.2f} ms, "
+            f"max {self.max_render_time * 1000:.2f} ms, "
+            f"load {self.load:.0%}, "
+            f"{self.underflows} sink underflows"
+        )
+
+
+def stream(
+    blocks: Iterable[np.ndarray],
+    sink,
+    sample_rate: int,
+    block_size: int,
+    lookahead: int = LOOKAHEAD,
+    realtime: bool = True,
+    clock: Callable[[], float] = time.perf_counter,
+    sleep: Callable[[float], None] = time.sleep,
+) -> StreamStats:
+    """
+    Feeds blocks of audio to a sink against a consumer clock.
+
+    The first lookahead blocks are rendered as fast as possible and then
+    written to the sink at once; the consumer starts playing at that
+    moment, and plays block i at start + i * block_duration, which is the
+    deadline of the block. Every later block is rendered no earlier than
+    lookahead blocks before its deadline, so the sink holds about
+    lookahead blocks, and the latency between rendering and playback is
+    bounded by lookahead blocks. A block that is ready after its deadline
+    is a miss, which is logged and counted.
+
+    If realtime is False, blocks are rendered as fast as possible, and a
+    block is a miss if rendering it took longer than its duration. The
+    stream ends when the blocks run out or on KeyboardInterrupt. Buffer
+    underflows reported by the sink (see DeviceSink) are added to the
+    statistics.
+
+    :param blocks: blocks of block_size x 2 samples, e.g. from
+        Automatone.stream
+    :param sink: object with a write(block) method and an underflows
+        count, e.g. a NullSink, PipeSink or DeviceSink
+    :param sample_rate: sample rate in Hz
+    :param block_size: number of samples per block
+    :param lookahead: number of blocks rendered ahead of the consumer, at
+        least 1
+    :param realtime: if True, pace rendering by the consumer clock
+    :param clock: function returning the current time in seconds
+    :param sleep: function that waits for a number of seconds
+    :return: statistics of the stream
+    """
+    block_duration = block_size / sample_rate
+    lookahead = max(lookahead, 1)
+    stats = StreamStats(block_duration)
+
+    blocks = iter(blocks)
+    i = 0
+    try:
+        # fill the buffer of the consumer before it starts playing
+        buffered = []
+        while len(buffered) < lookahead:
+            before = clock()
+            block = next(blocks, None)
+            if block is None:
+                break
+            stats.add(clock() - before, 0.0)
+            buffered.append(block)
+        for block in buffered:
+            sink.write(block)
+            i += 1
+        start = clock()
+
+        while True:
+            if realtime:
+                wait = start + (i - lookahead) * block_duration - clock()
+                if wait > 0:
+                    sleep(wait)
+
+            before = clock()
+            block = next(blocks, None)
+            if block is None:
+                break
+            after = clock()
+
+            if realtime:
+                lateness = after - (start + i * block_duration)
+            else:
+                lateness = (after - before) - block_duration
+            stats.add(after - before, lateness)
+            if lateness > 0:
+                late = lateness * 1000
+                logger.warning(
+                    f"Block {i} missed its deadline by {late:.1f} ms"
+                )
+
+            sink.write(block)
+            i += 1
+    except KeyboardInterrupt:
+        # an endless stream is stopped by interrupting it
+        logger.info(f"Stopped after {i} blocks")
+
+    stats.underflows = sink.underflows
+    return stats
+
+
+class NullSink:
+    def __init__(self):
+        """
+        A NullSink discards all blocks; it is used to test and benchmark
+        streaming without a sound device.
+        """
+        self.frames = 0
+        self.underflows = 0
+
+    def write(self, block: np.ndarray) -> None:
+        self.frames += len(block)
+
+    def close(self) -> None:
+        pass
+
+    def __enter__(self) -> "NullSink":
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+
+class PipeSink:
+    def __init__(self, file: Optional[BinaryIO] = None, dtype="int16"):
+        """
+        A PipeSink writes blocks as raw interleaved little-endian samples
+        to a binary file, by default standard output, e.g. to be played
+        with `aplay -f S16_LE -c 2 -r <sample rate>`.
+
+        :param file: binary file to write to
+        :param dtype: sample type, "int16" or "float32"
+        """
+        if dtype not in PIPE_DTYPES:
+            raise ValueError(f"Unsupported sample type: {dtype}")
+        self.file = sys.stdout.buffer if file is None else file
+        self.dtype = dtype
+        # the reader of the pipe is not observed
+        self.underflows = 0
+
+    def write(self, block: np.ndarray) -> None:
+        if self.dtype == "int16":
+            block = np.round(block * (2**15 - 1))
+        self.file.write(block.astype(PIPE_DTYPES[self.dtype]).tobytes())
+        self.file.flush()
+
+    def close(self) -> None:
+        self.file.flush()
+
+    def __enter__(self) -> "PipeSink":
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+
+class DeviceSink:
+    def __init__(
+        self,
+        sample_rate: int,
+        block_size: int = STREAM_BLOCK_SIZE,
+        channels: int = 2,
+    ):
+        """
+        A DeviceSink plays blocks on the default sound device. It requires
+        the optional sounddevice package. Buffer underflows of the device,
+        i.e. gaps in playback, are logged and counted in underflows.
+
+        :param sample_rate: sample rate in Hz
+        :param block_size: number of samples per block
+        :param channels: number of channels
+        """
+        try:
+            import sounddevice
+        except ImportError as e:
+            raise ImportError(
+                "Playing on a sound device requires the sounddevice "
+                "package: pip install sounddevice"
+            ) from e
+
+        self._stream = sounddevice.OutputStream(
+            samplerate=sample_rate,
+            blocksize=block_size,
+            channels=channels,
+            dtype="float32",
+        )
+        self._stream.start()
+        self.underflows = 0
+
+    def write(self, block: np.ndarray) -> None:
+        block = np.ascontiguousarray(block, dtype=np.float32)
+        if self._stream.write(block):
+            self.underflows += 1
+            logger.warning("Sound device buffer underflow")
+
+    def close(self) -> None:
+        self._stream.stop()
+        self._stream.close()
+
+    def __enter__(self) -> "DeviceSink":
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
@@ -1,9 +1,20 @@
-from typing import Tuple, List
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
+from typing import Dict, Iterable, Iterator, Tuple, List, Optional, Union
 
 import numpy as np
-from tqdm import tqdm
 
-from tone import Tone
+from audio import iterate_blocks, open_wav_memmap, to_int32
+from noise import NOISE_SEED, get_noise_bank
+from tone import Tone, pan_gains, wave_id
+
+# normalization strategies for streamed rendering
+NORMALIZE_BOUND = "bound"
+NORMALIZE_TWO_PASS = "two-pass"
+
+# onsets closer than this to a sample (in samples) are aligned to it
+ONSET_TOLERANCE = 1e-6
 
 
 def find_bounds(tone: Tone, sample_rate: int) -> Tuple[int, int]:
@@ -28,51 +39,313 @@ def find_bounds(tone: Tone, sample_rate: int) -> Tuple[int, int]:
     return i_start, i_end
 
 
+def find_onsets(
+    start_times: np.ndarray, sample_rate: int, snap: bool = False
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Given the start times of tones, find the global index of the sample at
+    (or before) which each tone starts and the fractional sample offset of
+    the onset relative to that index.
+
+    By default onsets are kept exact: a tone rendered with its phase (see
+    render_template) lands on the same time stamps as if it were rendered
+    on the global time axis. Onsets within ONSET_TOLERANCE samples of an
+    integer are treated as integer, so that rounding errors in the start
+    times do not create spurious phases.
+
+    If snap is True, onsets are rounded to the nearest sample and all
+    phases are 0, so that every tone with the same template can reuse one
+    buffer. The timing error of each tone is then at most half a sample,
+    i.e. 0.5 / sample_rate seconds (about 5.2 microseconds at 96 kHz).
+
+    :param start_times: array with start times in seconds
+    :param sample_rate: sample rate in Hz
+    :param snap: if True, snap onsets to the nearest sample
+    :return: start samples and phases (between 0 and 1) of the tones
+    """
+    onsets = np.asarray(start_times, dtype=np.float64) * sample_rate
+    nearest = np.round(onsets)
+    if snap:
+        snapped = np.full(onsets.shape, True)
+    else:
+        snapped = np.abs(onsets - nearest) <= ONSET_TOLERANCE
+
+    i_starts = np.where(snapped, nearest, np.floor(onsets)).astype(int)
+    phases = np.where(snapped, 0.0, onsets - i_starts)
+    return i_starts, phases
+
+
+def max_overlap(
+    starts: np.ndarray, ends: np.ndarray, weights: np.ndarray
+) -> float:
+    """
+    Given a set of weighted intervals [start, end), find the largest sum of
+    weights of intervals that overlap at any point.
+
+    :param starts: start of each interval
+    :param ends: end of each interval (exclusive)
+    :param weights: non-negative weight of each interval
+    :return: maximum total weight
+    """
+    times = np.concatenate([ends, starts])
+    deltas = np.concatenate([-weights, weights])
+    # intervals that end at a time are removed before new ones are added
+    order = np.argsort(times, kind="stable")
+    totals = np.cumsum(deltas[order])
+    if len(totals) == 0:
+        return 0.0
+    return max(float(np.max(totals)), 0.0)
+
+
+# columns of the event table stored by a Sequence, with their dtypes.
+# "wave" holds the wave id (see oscillators.WAVES)
+EVENT_FIELDS = {
+    "start_time": np.float64,
+    "attack_time": np.float64,
+    "decay_time": np.float64,
+    "sustain_time": np.float64,
+    "sustain_level": np.float64,
+    "release_time": np.float64,
+    "pitch": np.float64,
+    "volume": np.float64,
+    "pan": np.float64,
+    "wave": np.int8,
+    "noise_ratio": np.float64,
+}
+
+
+def events_from_tones(tones: List[Tone]) -> Dict[str, np.ndarray]:
+    """
+    Converts a list of Tone objects into a columnar event table.
+
+    :param tones: list of tones
+    :return: dictionary mapping each event field to an array
+    """
+    events = {
+        "start_time": [tone.start_time for tone in tones],
+        "attack_time": [tone.attack for tone in tones],
+        "decay_time": [tone.decay_time for tone in tones],
+        "sustain_time": [tone.sustain_time for tone in tones],
+        "sustain_level": [tone.sustain_level for tone in tones],
+        "release_time": [tone.release_time for tone in tones],
+        "pitch": [tone.pitch for tone in tones],
+        "volume": [tone.volume for tone in tones],
+        "pan": [tone.pan for tone in tones],
+        "wave": [wave_id(tone.wave) for tone in tones],
+        "noise_ratio": [tone.noise_ratio for tone in tones],
+    }
+    return {
+        key: np.array(value, dtype=EVENT_FIELDS[key])
+        for key, value in events.items()
+    }
+
+
+# event fields that determine the rendered waveform of a tone, apart from
+# its position in time and its panning
+TEMPLATE_FIELDS = [
+    key for key in EVENT_FIELDS if key not in ("start_time", "pan")
+]
+
+# default number of samples per block for streamed rendering
+BLOCK_SIZE = 65536
+
+# maximum number of tone templates kept in memory by a TemplateCache
+TEMPLATE_CACHE_SIZE = 256
+
+
 class Sequence:
     def __init__(self) -> None:
-        self.sequence: List[Tone] = []
+        """
+        A Sequence is a collection of tones, stored as a columnar event
+        table with one array per field (see EVENT_FIELDS). The arrays are
+        over-allocated so that appending is amortized O(1) per event.
+        """
+        self._events = {
+            key: np.empty(0, dtype=dtype)
+            for key, dtype in EVENT_FIELDS.items()
+        }
+        self._size = 0
+        self._end_time = 1.0
 
-    def add(self, other: List) -> None:
+    def add(self, other: Union[List[Tone], "Sequence"]) -> None:
         """
         Add one or more tones to the sequence
-        :param other: a list of tones
+        :param other: a list of tones, or another sequence
+
+        :return: None
+        """
+        if isinstance(other, Sequence):
+            self.add_events(other.events)
+        else:
+            self.add_events(events_from_tones(other))
+
+    def add_events(self, events: Dict[str, np.ndarray]) -> None:
+        """
+        Add the tones described by a columnar event table
+        (see activations.trigger_events) to the sequence
+
+        :param events: dictionary mapping each event field to an array
+            with one entry per event
 
         :return: None
         """
-        self.sequence += other
+        n = len(events["start_time"])
+        if n == 0:
+            return
+
+        size = self._size + n
+        capacity = len(self._events["start_time"])
+        if size > capacity:
+            capacity = max(size, 2 * capacity)
+            for key, column in self._events.items():
+                grown = np.empty(capacity, dtype=column.dtype)
+                grown[: self._size] = column[: self._size]
+                self._events[key] = grown
+
+        start = self._size
+        for key, column in self._events.items():
+            value = np.asarray(events[key])
+            if key == "wave" and value.dtype.kind in "US":
+                value = np.array([wave_id(w) for w in value.tolist()])
+            column[start:size] = value
+
+        self._size = size
+
+        # keep track of the end of the last tone, so that the duration
+        # does not have to be recomputed
+        end_time = self._end_time_of(slice(start, size)).max()
+        self._end_time = max(self._end_time, float(end_time))
+
+    def _end_time_of(self, index: slice) -> np.ndarray:
+        events = self._events
+        duration = (
+            events["attack_time"][index]
+            + events["decay_time"][index]
+            + events["sustain_time"][index]
+            + events["release_time"][index]
+        )
+        return events["start_time"][index] + duration
+
+    @property
+    def events(self) -> Dict[str, np.ndarray]:
+        """
+        Columnar event table of the sequence. The arrays are views on the
+        internal storage and should not be modified.
+        """
+        return {
+            key: column[: self._size] for key, column in self._events.items()
+        }
+
+    def tones(self) -> Iterator[Tone]:
+        """
+        Iterates over the events of the sequence as Tone objects.
+        """
+        columns = {key: value.tolist() for key, value in self.events.items()}
+        for i in range(self._size):
+            kwargs = {key: value[i] for key, value in columns.items()}
+            yield Tone(**kwargs)
+
+    @property
+    def sequence(self) -> List[Tone]:
+        """
+        List of Tone objects in the sequence. Every access creates new
+        objects; use events for bulk access.
+        """
+        return list(self.tones())
 
     def __len__(self):
-        return len(self.sequence)
+        return self._size
 
     @property
     def duration(self) -> float:
-        duration = 1
-        for tone in self.sequence:
-            d = tone.start_time + tone._duration
-            if d > duration:
-                duration = d
-
-        return duration
+        return self._end_time
 
     def render(
         self,
         sample_rate: int,
         normalize: bool = True,
         progress_bar: bool = False,
+        snap_onsets: bool = False,
+        target: Optional[str] = None,
+        target_dtype: str = "float32",
+        noise_seed: int = NOISE_SEED,
+        noise_key=0,
+        dtype=np.float64,
+        workers: int = 1,
+        processes: bool = False,
     ) -> np.ndarray:
+        """
+        Renders the sequence to a stereo audio array.
+
+        Tones that only differ in start time and pan share a template
+        (see render_template), which is rendered once and then added at
+        each onset. Noise is read per tone from a seeded noise bank (see
+        noise.NoiseBank) and scaled by the template's noise gain, so the
+        result is reproducible.
+
+        :param sample_rate: sample rate in Hz
+        :param normalize: if True, scale the result to a peak of 1
+        :param progress_bar: if True, show progress per tone
+        :param snap_onsets: if True, round onsets to the nearest sample,
+            so that tones with the same template reuse one buffer even if
+            their start times fall between samples (see find_onsets)
+        :param target: if given, render into the sample data of a WAV file
+            at this path instead of into memory (see render_to_wav)
+        :param target_dtype: sample type of the target file, "float32"
+            or "int32"
+        :param noise_seed: seed of the noise bank
+        :param noise_key: key of the noise of each tone, or one key for
+            all tones (see noise.NoiseBank.offsets)
+        :param dtype: floating point type used for mixing and of the
+            result, e.g. np.float32 to halve memory use; ignored if a
+            target is given
+        :param workers: number of threads that mix disjoint parts of the
+            result (see Mixer.mix_parallel); the result does not depend on
+            the number of workers
+        :param processes: if True, the workers are processes instead of
+            threads
+        :return: n x 2 array with the left and right channel
+        """
+        if target is not None:
+            return self.render_to_wav(
+                target,
+                sample_rate=sample_rate,
+                dtype=target_dtype,
+                normalize=normalize,
+                progress_bar=progress_bar,
+                snap_onsets=snap_onsets,
+                noise_seed=noise_seed,
+                noise_key=noise_key,
+                workers=workers,
+                processes=processes,
+            )
+
         n = np.ceil(sample_rate * self.duration).astype(int)
-        result = np.zeros((n, 2))
-        t = np.linspace(0, self.duration, n)
-        assert len(t) == len(result)
+        result = np.zeros((n, 2), dtype=dtype)
 
-        if progress_bar:
-            enum = tqdm(self.sequence)
+        mixer = Mixer(
+            self.events,
+            sample_rate,
+            snap_onsets=snap_onsets,
+            noise_seed=noise_seed,
+            noise_key=noise_key,
+            dtype=dtype,
+        )
+        if workers > 1:
+            mixer.mix_parallel(
+                result,
+                workers,
+                progress_bar=progress_bar,
+                processes=processes,
+            )
         else:
-            enum = self.sequence
+            if progress_bar:
+                from tqdm import tqdm
 
-        for i, tone in enumerate(enum):
-            i_start, i_end = find_bounds(tone, sample_rate)
-            result[i_start:i_end, :] += tone.render(t[i_start:i_end])
+                enum = tqdm(range(len(self)))
+            else:
+                enum = range(len(self))
+            mixer.mix(result, 0, enum)
 
         if normalize:
             minimum = np.min(result)
@@ -81,3 +354,667 @@ class Sequence:
             result /= absmax
 
         return result
+
+    def render_to_wav(
+        self,
+        path: str,
+        sample_rate: int,
+        dtype: str = "float32",
+        normalize: bool = True,
+        progress_bar: bool = False,
+        snap_onsets: bool = False,
+        block_size: int = BLOCK_SIZE,
+        noise_seed: int = NOISE_SEED,
+        noise_key=0,
+        workers: int = 1,
+        processes: bool = False,
+    ) -> np.memmap:
+        """
+        Renders the sequence straight into the sample data of a WAV file,
+        which is memory-mapped (see audio.open_wav_memmap). The finished
+        file needs no further writing, and the mix buffer lives in the
+        page cache instead of in process memory.
+
+        With dtype "float32", tones are mixed directly into the file and
+        then normalized in place, block by block. With dtype "int32", the
+        sequence is rendered in blocks with two-pass normalization (see
+        render_blocks) and each block is converted into the file.
+
+        :param path: path of the WAV file
+        :param sample_rate: sample rate in Hz
+        :param dtype: sample type of the file, "float32" or "int32"
+        :param normalize: if True, scale the result to a peak of 1
+        :param progress_bar: if True, show progress
+        :param snap_onsets: see render
+        :param block_size: number of samples processed at once
+        :param noise_seed: seed of the noise bank
+        :param noise_key: key of the noise of each tone, or one key for
+            all tones (see noise.NoiseBank.offsets)
+        :param workers: number of threads that mix into the file (see
+            render); only used with dtype "float32"
+        :param processes: if True, the workers are processes instead of
+            threads
+        :return: n x 2 memory-mapped array with the left and right channel
+        """
+        n = np.ceil(sample_rate * self.duration).astype(int)
+        result = open_wav_memmap(path, n, sample_rate, dtype=dtype)
+
+        if np.dtype(dtype) == np.int32:
+            blocks = self.render_blocks(
+                sample_rate,
+                block_size=block_size,
+                normalize=NORMALIZE_TWO_PASS if normalize else None,
+                progress_bar=progress_bar,
+                snap_onsets=snap_onsets,
+                noise_seed=noise_seed,
+                noise_key=noise_key,
+            )
+            offset = 0
+            for block in blocks:
+                end = offset + len(block)
+                to_int32(block, result[offset:end], np.empty(block.shape))
+                offset = end
+        else:
+            mixer = Mixer(
+                self.events,
+                sample_rate,
+                snap_onsets=snap_onsets,
+                noise_seed=noise_seed,
+                noise_key=noise_key,
+                dtype=result.dtype,
+            )
+            if workers > 1:
+                mixer.mix_parallel(
+                    result,
+                    workers,
+                    progress_bar=progress_bar,
+                    processes=processes,
+                )
+            else:
+                if progress_bar:
+                    from tqdm import tqdm
+
+                    enum = tqdm(range(len(self)))
+                else:
+                    enum = range(len(self))
+                mixer.mix(result, 0, enum)
+
+            if normalize:
+                absmax = 0.0
+                for block in iterate_blocks(result, block_size):
+                    absmax = max(absmax, float(np.max(np.abs(block))))
+                if absmax > 0:
+                    for block in iterate_blocks(result, block_size):
+                        block /= absmax
+
+        result.flush()
+        return result
+
+    def render_blocks(
+        self,
+        sample_rate: int,
+        block_size: int = BLOCK_SIZE,
+        normalize: Optional[str] = None,
+        progress_bar: bool = False,
+        snap_onsets: bool = False,
+        noise_seed: int = NOISE_SEED,
+        noise_key=0,
+        dtype=np.float64,
+    ) -> Iterator[np.ndarray]:
+        """
+        Renders the sequence as consecutive blocks of stereo audio, so that
+        memory use depends on the block size rather than on the length of
+        the sequence. Concatenating all blocks gives the same result as
+        render(..., normalize=False).
+
+        Since the peak of the whole sequence is not known while streaming,
+        normalization is done in one of two ways:
+
+        - "bound": divide by a conservative peak bound computed from the
+          event table (see Mixer.peak_bound). This costs almost nothing,
+          but the result usually peaks below 1. Samples are clipped to
+          [-1, 1] to guard against rounding errors.
+        - "two-pass": render all blocks once to find the exact peak, then
+          render them again. This doubles the rendering time, and gives
+          the same result as render(..., normalize=True).
+
+        :param sample_rate: sample rate in Hz
+        :param block_size: number of samples per block; the last block
+            may be shorter
+        :param normalize: None, "bound" or "two-pass"
+        :param progress_bar: if True, show progress per block
+        :param snap_onsets: see render
+        :param noise_seed: seed of the noise bank
+        :param noise_key: key of the noise of each tone, or one key for
+            all tones (see noise.NoiseBank.offsets)
+        :param dtype: floating point type used for mixing and of the blocks
+        :return: iterator over block_size x 2 arrays
+        """
+        n = np.ceil(sample_rate * self.duration).astype(int)
+        mixer = Mixer(
+            self.events,
+            sample_rate,
+            snap_onsets=snap_onsets,
+            noise_seed=noise_seed,
+            noise_key=noise_key,
+            dtype=dtype,
+        )
+
+        if normalize is None:
+            peak = 1.0
+        elif normalize == NORMALIZE_BOUND:
+            peak = mixer.peak_bound()
+        elif normalize == NORMALIZE_TWO_PASS:
+            peak = 0.0
+            for block in mixer.render_blocks(n, block_size):
+                peak = max(peak, np.max(np.abs(block)))
+        else:
+            raise ValueError(f"Unknown normalization: {normalize}")
+
+        blocks = mixer.render_blocks(n, block_size)
+        if progress_bar:
+            from tqdm import tqdm
+
+            blocks = tqdm(blocks, total=-(-n // block_size))
+
+        for block in blocks:
+            if normalize is not None and peak > 0:
+                block /= peak
+            if normalize == NORMALIZE_BOUND:
+                np.clip(block, -1, 1, out=block)
+            yield block
+
+
+class LiveSequence:
+    def __init__(
+        self,
+        sample_rate: int,
+        snap_onsets: bool = False,
+        noise_seed: int = NOISE_SEED,
+        dtype=np.float64,
+    ) -> None:
+        """
+        A LiveSequence holds the tones of a sequence that is produced while
+        it is rendered block by block (see Automatone.stream). Tones are
+        added before the block in which they start, and dropped once they
+        have ended, so memory use depends on the number of overlapping
+        tones rather than on the length of the sequence. Rendered blocks
+        are the same as those of Sequence.render_blocks for the same tones.
+
+        :param sample_rate: sample rate in Hz
+        :param snap_onsets: if True, round onsets to the nearest sample
+            (see find_onsets)
+        :param noise_seed: seed of the noise bank
+        :param dtype: floating point type of the blocks
+        """
+        self.sample_rate = sample_rate
+        self.snap_onsets = snap_onsets
+        self.noise_seed = noise_seed
+        self.dtype = np.dtype(dtype)
+        self._events = {
+            key: np.empty(0, dtype=dtype)
+            for key, dtype in EVENT_FIELDS.items()
+        }
+        self._mixer: Optional[Mixer] = None
+        # the mixer is rebuilt when tones are added or dropped, but the
+        # templates of the remaining tones are kept
+        self._templates = TemplateCache()
+        # end of the last tone that was added, at least 1 second like
+        # Sequence.duration
+        self._end_time = 1.0
+
+    def __len__(self):
+        return len(self._events["start_time"])
+
+    @property
+    def duration(self) -> float:
+        return self._end_time
+
+    def add_events(self, events: Dict[str, np.ndarray]) -> None:
+        """
+        Add the tones described by a columnar event table. Tones must be
+        added before the block in which they start is rendered.
+
+        :param events: dictionary mapping each event field to an array
+            with one entry per event
+        :return: None
+        """
+        if len(events["start_time"]) == 0:
+            return
+        for key, column in self._events.items():
+            self._events[key] = np.concatenate([column, events[key]])
+        self._mixer = None
+
+        end_time = (
+            events["start_time"]
+            + events["attack_time"]
+            + events["decay_time"]
+            + events["sustain_time"]
+            + events["release_time"]
+        ).max()
+        self._end_time = max(self._end_time, float(end_time))
+
+    def render(self, offset: int, end: int) -> np.ndarray:
+        """
+        Renders the samples offset..end, after dropping the tones that
+        ended before offset. Blocks must be rendered in order.
+
+        :param offset: global index of the first sample of the block
+        :param end: global index of the sample after the block
+        :return: (end - offset) x 2 array
+        """
+        if self._mixer is not None:
+            alive = self._mixer.i_ends > offset
+            if not alive.all():
+                self._events = {
+                    key: column[alive] for key, column in self._events.items()
+                }
+                self._mixer = None
+        if self._mixer is None:
+            self._mixer = Mixer(
+                self._events,
+                self.sample_rate,
+                snap_onsets=self.snap_onsets,
+                noise_seed=self.noise_seed,
+                dtype=self.dtype,
+                templates=self._templates,
+            )
+
+        block = np.zeros((end - offset, 2), dtype=self.dtype)
+        self._mixer.mix(block, offset, range(len(self)))
+        return block
+
+
+class Mixer:
+    def __init__(
+        self,
+        events: Dict[str, np.ndarray],
+        sample_rate: int,
+        snap_onsets: bool = False,
+        noise_seed: int = NOISE_SEED,
+        noise_key=0,
+        dtype=np.float64,
+        templates: Optional["TemplateCache"] = None,
+    ) -> None:
+        """
+        A Mixer adds the tones of an event table (see Sequence.events)
+        into audio buffers, using one template per distinct tone
+        (see render_template). Noise is read from a shared noise bank
+        (see noise.NoiseBank), so the result does not depend on which
+        buffers the tones are mixed into.
+
+        :param events: columnar event table
+        :param sample_rate: sample rate in Hz
+        :param snap_onsets: if True, round onsets to the nearest sample
+            (see find_onsets)
+        :param noise_seed: seed of the noise bank
+        :param noise_key: key of the noise of each tone, or one key for
+            all tones (see noise.NoiseBank.offsets)
+        :param dtype: floating point type of the templates and of the
+            buffers that tones are mixed into
+        :param templates: cache of the templates; if None, the Mixer gets
+            its own TemplateCache
+        """
+        self.sample_rate = sample_rate
+        self.dtype = np.dtype(dtype)
+        self.templates = TemplateCache() if templates is None else templates
+        self.snap_onsets = snap_onsets
+        self.noise_seed = noise_seed
+        self.noise_key = noise_key
+        self.events = events
+        self.noise_ratio = events["noise_ratio"]
+        self.noise_bank = get_noise_bank(noise_seed)
+        self.noise_offsets = self.noise_bank.offsets(
+            events["start_time"], events["pitch"], events["pan"], noise_key
+        )
+
+        self.i_starts, phases = find_onsets(
+            events["start_time"], sample_rate, snap=snap_onsets
+        )
+        durations = (
+            events["attack_time"]
+            + events["decay_time"]
+            + events["sustain_time"]
+            + events["release_time"]
+        )
+        # same length as the templates, see render_template
+        lengths = np.ceil(phases + durations * sample_rate).astype(int)
+        self.i_ends = self.i_starts + lengths
+
+        # left and right gain, computed once per distinct pan value
+        pans, pan_inverse = np.unique(
+            np.clip(events["pan"], 0, 1), return_inverse=True
+        )
+        self.channel_gains = np.column_stack(pan_gains(pans)).astype(
+            self.dtype
+        )
+        self.pan_inverse = pan_inverse.reshape(-1)
+
+        # group tones with identical templates
+        keys = np.column_stack(
+            [events[key] for key in TEMPLATE_FIELDS] + [phases]
+        )
+        keys, inverse = np.unique(keys, axis=0, return_inverse=True)
+        self.keys = keys
+        self.inverse = inverse.reshape(-1)
+
+        # index of tones sorted by start sample
+        self.order = np.argsort(self.i_starts, kind="stable")
+
+    def template(self, i: int) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Returns the template of the i-th tone.
+
+        :param i: index of the tone in the event table
+        :return: signal and noise gain of the tone (see render_template)
+        """
+        key = self.keys[self.inverse[i]]
+        return self.templates.get(
+            tuple(key[:-1].tolist()),
+            self.sample_rate,
+            float(key[-1]),
+            self.dtype,
+        )
+
+    def mix(self, out: np.ndarray, offset: int, indices: Iterable) -> None:
+        """
+        Adds the parts of the given tones that overlap with a buffer.
+        The mono template of each tone is scaled by its pan gains into a
+        scratch buffer, which is added to each channel; the scratch
+        buffers are reused between tones, so no stereo copy of a template
+        is made.
+
+        :param out: n x 2 buffer, to which the tones are added in place
+        :param offset: global index of the first sample of the buffer
+        :param indices: indices of the tones in the event table
+        :return: None
+        """
+        n = len(out)
+        scratch = np.empty(0, dtype=self.dtype)
+        for i in indices:
+            signal, noise_gain = self.template(i)
+            gains = self.channel_gains[self.pan_inverse[i]]
+            i_start = self.i_starts[i]
+            # overlap of the tone with the buffer, relative to the tone
+            lo = max(offset - i_start, 0)
+            hi = min(len(signal), offset + n - i_start)
+            if hi <= lo:
+                continue
+
+            j_start = i_start + lo - offset
+            j_end = i_start + hi - offset
+            if len(scratch) < hi - lo:
+                scratch = np.empty(len(signal), dtype=self.dtype)
+            part = scratch[: hi - lo]
+            for channel, gain in enumerate(gains):
+                np.multiply(signal[lo:hi], gain, out=part)
+                out[j_start:j_end, channel] += part
+
+            if self.noise_ratio[i] != 0:
+                noise = self.noise_bank.read(
+                    self.noise_offsets[i] + lo, hi - lo
+                )
+                for channel, gain in enumerate(gains):
+                    np.multiply(noise_gain[lo:hi], gain, out=part)
+                    part *= noise
+                    out[j_start:j_end, channel] += part
+
+    def mix_parallel(
+        self,
+        out: np.ndarray,
+        workers: int,
+        block_size: int = BLOCK_SIZE,
+        progress_bar: bool = False,
+        processes: bool = False,
+    ) -> None:
+        """
+        Mixes all tones into a buffer using a pool of threads or
+        processes. The buffer is split into disjoint blocks (see blocks),
+        and each block is mixed by one worker, so workers never write to
+        the same samples. Tones that span several blocks are split between
+        them.
+
+        Within a block, tones are added in the order of the event table,
+        like mix(out, 0, range(len(events))) does, so every sample is the
+        result of the same additions and the output is identical to
+        serial mixing.
+
+        Threads mix into the buffer directly, but the loop over the tones
+        in mix holds the GIL between numpy operations, so threads only
+        scale as far as the operations on long tones do. With processes,
+        each process builds its own Mixer from the event table once, and
+        returns the blocks it mixes, which are added to the buffer here;
+        at most two blocks per process are in flight. The buffer must be
+        zero for the output to be identical in that case.
+
+        :param out: n x 2 buffer, to which the tones are added in place
+        :param workers: number of threads or processes
+        :param block_size: number of samples per block
+        :param progress_bar: if True, show progress per block
+        :param processes: if True, use processes instead of threads
+        :return: None
+        """
+        blocks = self.blocks(len(out), block_size)
+        if progress_bar:
+            from tqdm import tqdm
+
+        if not processes:
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                futures = [
+                    executor.submit(
+                        self.mix, out[offset:end], offset, np.sort(indices)
+                    )
+                    for offset, end, indices in blocks
+                ]
+                if progress_bar:
+                    futures = tqdm(futures)
+                for future in futures:
+                    future.result()
+            return
+
+        if progress_bar:
+            blocks = tqdm(blocks, total=-(-len(out) // block_size))
+
+        # multiprocessing is slow to import and only needed here
+        from concurrent.futures import ProcessPoolExecutor
+
+        arguments = (
+            self.events,
+            self.sample_rate,
+            self.snap_onsets,
+            self.noise_seed,
+            self.noise_key,
+            self.dtype,
+        )
+        with ProcessPoolExecutor(
+            max_workers=workers,
+            initializer=_init_mix_process,
+            initargs=arguments,
+        ) as executor:
+            pending = deque()
+            for offset, end, indices in blocks:
+                future = executor.submit(
+                    _mix_block, offset, end, np.sort(indices)
+                )
+                pending.append((offset, end, future))
+                if len(pending) >= 2 * workers:
+                    offset, end, future = pending.popleft()
+                    out[offset:end] += future.result()
+            for offset, end, future in pending:
+                out[offset:end] += future.result()
+
+    def blocks(
+        self, n: int, block_size: int
+    ) -> Iterator[Tuple[int, int, np.ndarray]]:
+        """
+        Splits the samples 0..n into consecutive blocks and finds the tones
+        that overlap with each block. Tones are taken from the index sorted
+        by start sample, and dropped once they have ended, so each block
+        only touches the tones that sound during it.
+
+        :param n: total number of samples
+        :param block_size: number of samples per block
+        :return: iterator over the start and end sample of each block, and
+            the indices of the tones that overlap with it
+        """
+        starts = self.i_starts[self.order]
+        active = np.empty(0, dtype=int)
+        pointer = 0
+        for offset in range(0, n, block_size):
+            end = min(offset + block_size, n)
+            new = np.searchsorted(starts, end, side="left")
+            active = np.concatenate([active, self.order[pointer:new]])
+            active = active[self.i_ends[active] > offset]
+            pointer = new
+            yield offset, end, active
+
+    def render_blocks(self, n: int, block_size: int) -> Iterator[np.ndarray]:
+        """
+        Renders the samples 0..n as consecutive blocks (see blocks).
+
+        :param n: total number of samples
+        :param block_size: number of samples per block
+        :return: iterator over block_size x 2 arrays
+        """
+        for offset, end, indices in self.blocks(n, block_size):
+            block = np.zeros((end - offset, 2), dtype=self.dtype)
+            self.mix(block, offset, indices)
+            yield block
+
+    def peak_bound(self) -> float:
+        """
+        Computes an upper bound of the absolute value of the mixed tones,
+        without rendering them. The peak of each tone is bounded by its
+        volume times the maximum of its envelope, where noise counts with
+        the peak of the noise bank. The bound is the largest sum of the
+        peaks of all tones that sound at the same time, per channel.
+
+        :return: peak bound
+        """
+        events = self.events
+        envelope_peak = np.maximum(1, np.abs(events["sustain_level"]))
+        noise_ratio = events["noise_ratio"]
+        noise_peak = self.noise_bank.peak
+        peaks = (
+            np.abs(events["volume"])
+            * envelope_peak
+            * (np.abs(1 - noise_ratio) + noise_peak * np.abs(noise_ratio))
+        )
+
+        result = 0.0
+        for gains in self.channel_gains[self.pan_inverse].T:
+            overlap = max_overlap(self.i_starts, self.i_ends, gains * peaks)
+            result = max(result, overlap)
+        return result
+
+
+# Mixer of a process of Mixer.mix_parallel
+_process_mixer: Optional[Mixer] = None
+
+
+def _init_mix_process(
+    events: Dict[str, np.ndarray],
+    sample_rate: int,
+    snap_onsets: bool,
+    noise_seed: int,
+    noise_key,
+    dtype,
+) -> None:
+    global _process_mixer
+    _process_mixer = Mixer(
+        events,
+        sample_rate,
+        snap_onsets=snap_onsets,
+        noise_seed=noise_seed,
+        noise_key=noise_key,
+        dtype=dtype,
+    )
+
+
+def _mix_block(offset: int, end: int, indices: np.ndarray) -> np.ndarray:
+    block = np.zeros((end - offset, 2), dtype=_process_mixer.dtype)
+    _process_mixer.mix(block, offset, indices)
+    return block
+
+
+class TemplateCache:
+    def __init__(self, max_size: int = TEMPLATE_CACHE_SIZE) -> None:
+        """
+        A TemplateCache keeps the most recently used templates (see
+        render_template), so that tones which only differ in start time
+        and pan are rendered once. When it holds max_size templates, the
+        least recently used one is evicted. It can be shared by the
+        threads of Mixer.mix_parallel.
+
+        :param max_size: maximum number of templates
+        """
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._templates: OrderedDict = OrderedDict()
+        self._lock = Lock()
+
+    def __len__(self):
+        return len(self._templates)
+
+    def get(
+        self,
+        signature: Tuple[float, ...],
+        sample_rate: int,
+        phase: float,
+        dtype=np.float64,
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Returns a template, rendering it if it is not cached.
+
+        :param signature: values of the TEMPLATE_FIELDS of the tone
+        :param sample_rate: sample rate in Hz
+        :param phase: fractional sample at which the tone starts
+        :param dtype: floating point type of the template
+        :return: read-only signal and noise gain arrays
+        """
+        key = (signature, sample_rate, phase, np.dtype(dtype).str)
+        with self._lock:
+            template = self._templates.get(key)
+            if template is not None:
+                self._templates.move_to_end(key)
+                self.hits += 1
+                return template
+
+        template = render_template(signature, sample_rate, phase, dtype)
+        with self._lock:
+            self.misses += 1
+            self._templates[key] = template
+            while len(self._templates) > self.max_size:
+                self._templates.popitem(last=False)
+        return template
+
+
+def render_template(
+    signature: Tuple[float, ...],
+    sample_rate: int,
+    phase: float,
+    dtype=np.float64,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Renders the mono signal and noise gain of a tone starting at sample 0
+    (see Tone.render_components). Templates are cached by a TemplateCache.
+
+    :param signature: values of the TEMPLATE_FIELDS of the tone
+    :param sample_rate: sample rate in Hz
+    :param phase: fractional sample at which the tone starts, i.e.
+        start_time * sample_rate - floor(start_time * sample_rate)
+    :param dtype: floating point type of the template
+    :return: read-only signal and noise gain arrays
+    """
+    kwargs = dict(zip(TEMPLATE_FIELDS, signature))
+    kwargs["wave"] = int(kwargs["wave"])
+    tone = Tone(start_time=0.0, pan=0.5, **kwargs)
+
+    n = int(np.ceil(phase + tone._duration * sample_rate))
+    u = (np.arange(n) - phase) / sample_rate
+    signal, noise_gain = tone.render_components(u, sample_rate, dtype)
+
+    signal.flags.writeable = False
+    noise_gain.flags.writeable = False
+    return signal, noise_gain
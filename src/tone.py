@@ -1,5 +1,10 @@
+from typing import Optional, Tuple, Union
+
 import numpy as np
 
+from noise import NOISE_SEED, get_noise_bank
+from oscillators import WAVES, oscillate, wave_id
+
 
 def interpolate(
     t: np.ndarray,
@@ -26,7 +31,108 @@ def interpolate(
     return envelope
 
 
+def adsr_envelope(
+    t: np.ndarray,
+    attack_time,
+    decay_time,
+    sustain_time,
+    sustain_level,
+    release_time,
+    out: Optional[np.ndarray] = None,
+    dtype=np.float64,
+) -> np.ndarray:
+    """
+    Calculates ADSR envelopes in a single pass. The boundaries of the
+    attack, decay, sustain and release segments are found with
+    np.searchsorted, and each segment is written directly into the output,
+    so no temporary arrays of the full length are created.
+
+    The envelope parameters are either scalars, which gives one envelope,
+    or arrays of length m, which gives a batch of m envelopes on the same
+    time stamps.
+
+    :param t: time stamps relative to the start of the tone, sorted in
+        ascending order
+    :param attack_time: attack duration of envelope in seconds
+    :param decay_time: decay duration of envelope in seconds
+    :param sustain_time: sustain duration of envelope in seconds
+    :param sustain_level: sustain level of envelope
+    :param release_time: release duration of envelope in seconds
+    :param out: optional array to write the result to
+    :param dtype: floating point type of the result, if out is not given
+    :return: array of shape t.shape for scalar parameters, or
+        (m, len(t)) for arrays of parameters
+    """
+    params = np.broadcast_arrays(
+        attack_time, decay_time, sustain_time, sustain_level, release_time
+    )
+    batched = params[0].ndim > 0
+    if out is None:
+        out = np.empty(params[0].shape + t.shape, dtype=dtype)
+    rows = out if batched else out[np.newaxis]
+
+    # segment boundaries and levels of each envelope
+    t1 = params[0].reshape(-1)
+    t2 = t1 + params[1].reshape(-1)
+    t3 = t2 + params[2].reshape(-1)
+    t4 = t3 + params[4].reshape(-1)
+    levels = params[3].reshape(-1)
+    bounds = np.searchsorted(t, np.stack([np.zeros_like(t1), t1, t2, t3, t4]))
+
+    for k, row in enumerate(rows):
+        b = bounds[:, k].tolist()
+        times = (0.0, t1[k], t2[k], t3[k], t4[k])
+        segments = (
+            (0.0, 1.0),
+            (1.0, levels[k]),
+            (levels[k], levels[k]),
+            (levels[k], 0.0),
+        )
+        first, last = b[0], b[4]
+        row[:first] = 0
+        row[last:] = 0
+        for j, (level0, level1) in enumerate(segments):
+            start, end = b[j], b[j + 1]
+            if start == end:
+                continue
+            if level0 == level1:
+                row[start:end] = level0
+                continue
+            segment = row[start:end]
+            np.subtract(t[start:end], times[j], out=segment)
+            segment *= (level1 - level0) / (times[j + 1] - times[j])
+            segment += level0
+    return out
+
+
+def pan_gains(pan):
+    """
+    Calculates the gains of the left and right channel
+    using sine law panning.
+
+    :param pan: stereo panning (0=left, 1=right), scalar or array
+    :return: left and right gain
+    """
+    left = np.sin((1 - pan) * np.pi / 2)
+    right = np.sin(pan * np.pi / 2)
+    return left, right
+
+
 class Tone:
+    __slots__ = (
+        "start_time",
+        "pitch",
+        "volume",
+        "pan",
+        "_wave",
+        "attack",
+        "decay_time",
+        "sustain_time",
+        "sustain_level",
+        "release_time",
+        "noise_ratio",
+    )
+
     def __init__(
         self,
         start_time: float,
@@ -38,7 +144,7 @@ class Tone:
         pitch: float,
         volume: float,
         pan: float,
-        wave: str,
+        wave: Union[str, int],
         noise_ratio: float,
     ) -> None:
         """
@@ -48,6 +154,8 @@ class Tone:
         :param start_time: start time of the note
         :param duration: duration of the note
         :param pitch: tone pitch in Hertz
+        :param wave: type of soundwave (see oscillators.WAVES), by name
+            or by wave id
         """
         self.start_time = start_time
         self.pitch = pitch
@@ -63,6 +171,14 @@ class Tone:
 
         self.noise_ratio = noise_ratio
 
+    @property
+    def wave(self) -> str:
+        return WAVES[self._wave]
+
+    @wave.setter
+    def wave(self, wave: Union[str, int]) -> None:
+        self._wave = wave_id(wave)
+
     @property
     def _duration(self):
         result = self.attack + self.decay_time
@@ -73,72 +189,79 @@ class Tone:
     def _pan(self):
         return np.clip(self.pan, 0, 1)
 
-    def _calculate_envelope(self, t: np.ndarray) -> np.ndarray:
+    def _calculate_envelope(
+        self, t: np.ndarray, dtype=np.float64
+    ) -> np.ndarray:
         """
         Given an array with time stamps, calculate the
         loudness envelope of the tone for each time stamp.
 
-        :param t: array with time stamps
+        :param t: array with time stamps, sorted in ascending order
+        :param dtype: floating point type of the result
         :return: envelope value for each time stamp
         """
 
-        result = np.zeros(t.shape)
+        return adsr_envelope(
+            t,
+            self.attack,
+            self.decay_time,
+            self.sustain_time,
+            self.sustain_level,
+            self.release_time,
+            dtype=dtype,
+        )
 
-        # calculate ADSR times
-        t0 = 0.0
-        t1 = self.attack
-        t2 = t1 + self.decay_time
-        t3 = t2 + self.sustain_time
-        t4 = self._duration
+    def render_components(
+        self,
+        u: np.ndarray,
+        sample_rate: Optional[float] = None,
+        dtype=np.float64,
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        renders the mono tone at given time stamps relative to the start
+        of the tone, split into a deterministic signal and the gain that
+        is applied to standard normal noise. The mono tone is
+        signal + noise_gain * noise.
 
-        # calculate ADSR envelopes
-        attack_envelope = interpolate(t, t0, t1, 0, 1)
-        decay_envelope = interpolate(t, t1, t2, 1, self.sustain_level)
-        sustain_envelope = interpolate(
-            t, t2, t3, self.sustain_level, self.sustain_level
-        )
-        release_envelope = interpolate(t, t3, t4, self.sustain_level, 0)
-
-        # add them to result
-        result = (
-            result
-            + attack_envelope
-            + decay_envelope
-            + sustain_envelope
-            + release_envelope
-        )
+        :param u: array of time stamps relative to the start of the tone
+        :param sample_rate: sample rate in Hz, used to band-limit the
+            carrier (see oscillators.oscillate)
+        :param dtype: floating point type of the result. Time stamps and
+            phases are always evaluated in double precision.
+        :return: signal and noise gain for each time stamp
+        """
+        envelope = self._calculate_envelope(u, dtype=dtype)
+        carrier = oscillate(self._wave, u, self.pitch, sample_rate, dtype)
 
-        return result
+        gain = float(self.volume) * envelope
+        signal = gain * float(1 - self.noise_ratio) * carrier
+        noise_gain = gain * float(self.noise_ratio)
+        return signal, noise_gain
 
-    def render(self, t: np.ndarray) -> np.ndarray:
+    def render(
+        self, t: np.ndarray, noise_seed: int = NOISE_SEED, dtype=np.float64
+    ) -> np.ndarray:
         """
         renders tone value at given time
 
         :param t: array of timestamps at which to render the tone
+        :param noise_seed: seed of the noise bank (see noise.NoiseBank)
+        :param dtype: floating point type of the result
         :return: rendered value
         """
 
         # shift time stamps to start of tone
         u = t - self.start_time
 
-        envelope = self._calculate_envelope(u)
-
-        carrier_phase = u * self.pitch * 2 * np.pi
-        if self.wave == "sin":
-            carrier = np.sin(carrier_phase)
-        elif self.wave == "square":
-            carrier = np.sign(np.sin(carrier_phase))
-        else:
-            raise NotImplementedError
-
-        noise = np.random.normal(0, 1, len(u))
-        mixed = (1 - self.noise_ratio) * carrier + self.noise_ratio * noise
-        x = self.volume * envelope * mixed
-        x = x.reshape(-1, 1)
-
-        # sine law panning
-        left = np.sin((1 - self._pan) * np.pi / 2) * x
-        right = np.sin(self._pan * np.pi / 2) * x
+        x, noise_gain = self.render_components(u, dtype=dtype)
+        if self.noise_ratio != 0:
+            bank = get_noise_bank(noise_seed)
+            offset = bank.offsets(self.start_time, self.pitch, self.pan)
+            x = x + noise_gain * bank.read(int(offset), len(u))
 
-        result = np.concatenate([left, right], axis=1)
+        # write the panned signal straight into both channels
+        result = np.empty((len(x), 2), dtype=x.dtype)
+        left_gain, right_gain = pan_gains(self._pan)
+        np.multiply(x, float(left_gain), out=result[:, 0])
+        np.multiply(x, float(right_gain), out=result[:, 1])
         return result
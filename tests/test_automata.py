@@ -0,0 +1,70 @@
+import numpy as np
+import pytest
+
+from automata import (
+    CHECKPOINT_INTERVAL,
+    generate_cellular_automaton,
+    generate_combined_automaton,
+    int_to_bin,
+    pack_row,
+    step,
+    step_packed,
+    unpack_rows,
+)
+
+SIZES = [1, 2, 7, 24, 65]
+
+
+def reference(rule: int, size: int, steps: int, skip: int) -> np.ndarray:
+    """
+    Evolves the automaton with step() on unpacked rows, like the original
+    implementation of generate_cellular_automaton.
+    """
+    rule_b = int_to_bin(rule)
+    x = np.zeros(size, dtype=np.int8)
+    x[size // 2] = 1
+    rows = []
+    for i in range(skip + steps):
+        if i >= skip:
+            rows.append(x)
+        x = step(x, rule_b)
+    return np.array(rows, dtype=np.int8).reshape(steps, size)
+
+
+@pytest.mark.parametrize("size", SIZES)
+def test_all_rules_match_reference(size):
+    for rule in range(256):
+        for skip in (0, 5):
+            expected = reference(rule, size, 20, skip)
+            result = generate_cellular_automaton(rule, size, 20, skip)
+            np.testing.assert_array_equal(result, expected, err_msg=rule)
+
+
+@pytest.mark.parametrize("rule", [1, 30, 45, 90, 110, 150])
+@pytest.mark.parametrize("size", [16, 24])
+def test_skips_beyond_checkpoints_match_reference(rule, size):
+    for skip in (CHECKPOINT_INTERVAL, 2 * CHECKPOINT_INTERVAL + 37):
+        expected = reference(rule, size, 10, skip)
+        result = generate_cellular_automaton(rule, size, 10, skip)
+        np.testing.assert_array_equal(result, expected)
+
+
+@pytest.mark.parametrize("rules", [[30, 90], [1, 30], [110, 45, 30]])
+def test_combined_automaton_is_product(rules):
+    for skip in (0, 3, CHECKPOINT_INTERVAL + 1):
+        expected = np.prod(
+            [reference(rule, 24, 30, skip) for rule in rules], axis=0
+        )
+        result = generate_combined_automaton(rules, 24, 30, skip)
+        np.testing.assert_array_equal(result, expected)
+
+
+@pytest.mark.parametrize("size", SIZES)
+def test_packed_step_matches_step(size):
+    rng = np.random.default_rng(size)
+    for rule in range(256):
+        x = rng.integers(0, 2, size, dtype=np.int8)
+        packed = pack_row(x)
+        np.testing.assert_array_equal(unpack_rows([packed], size)[0], x)
+        expected = pack_row(step(x, int_to_bin(rule)))
+        assert step_packed(packed, rule, size) == expected
@@ -0,0 +1,82 @@
+import numpy as np
+
+import realtime
+
+BLOCK_SIZE = 1024
+SAMPLE_RATE = 44100
+BLOCK_DURATION = BLOCK_SIZE / SAMPLE_RATE
+
+
+class FakeClock:
+    def __init__(self):
+        self.time = 0.0
+
+    def __call__(self) -> float:
+        return self.time
+
+    def sleep(self, seconds: float) -> None:
+        self.time += seconds
+
+
+class RecordingSink:
+    def __init__(self, clock: FakeClock):
+        self.clock = clock
+        self.times = []
+        self.underflows = 0
+
+    def write(self, block: np.ndarray) -> None:
+        self.times.append(self.clock())
+
+
+def run(render_times, lookahead=4):
+    clock = FakeClock()
+
+    def blocks():
+        for render_time in render_times:
+            clock.time += render_time
+            yield np.zeros((BLOCK_SIZE, 2))
+
+    sink = RecordingSink(clock)
+    stats = realtime.stream(
+        blocks(),
+        sink,
+        SAMPLE_RATE,
+        BLOCK_SIZE,
+        lookahead=lookahead,
+        clock=clock,
+        sleep=clock.sleep,
+    )
+    # the consumer starts playing at the first write
+    start = sink.times[0]
+    lateness = [
+        t - (start + i * BLOCK_DURATION) for i, t in enumerate(sink.times)
+    ]
+    return stats, np.array(lateness)
+
+
+def test_blocks_are_rendered_ahead_of_playback():
+    _, lateness = run([0.001] * 12, lookahead=4)
+    # after the buffer is filled, every block is written about lookahead
+    # blocks before it is played
+    assert np.all(lateness[4:] < -3 * BLOCK_DURATION)
+
+
+def test_misses_match_the_consumer():
+    for slow in (0.02, 0.2):
+        render_times = [0.001] * 12
+        render_times[5] = slow
+        stats, lateness = run(render_times, lookahead=4)
+        assert stats.misses == np.sum(lateness > 0)
+        assert np.isclose(stats.max_lateness, max(lateness.max(), 0))
+
+
+def test_sink_underflows_are_reported():
+    clock = FakeClock()
+    sink = RecordingSink(clock)
+    sink.underflows = 3
+    blocks = [np.zeros((BLOCK_SIZE, 2))] * 2
+    stats = realtime.stream(
+        blocks, sink, SAMPLE_RATE, BLOCK_SIZE, clock=clock, sleep=clock.sleep
+    )
+    assert stats.underflows == 3
+    assert "3 sink underflows" in str(stats)
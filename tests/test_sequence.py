@@ -0,0 +1,33 @@
+import numpy as np
+import pytest
+
+from cli import create_automatone
+from sequence import Mixer
+
+SAMPLE_RATE = 8000
+
+
+@pytest.fixture(scope="module")
+def sequence():
+    # long enough to span several blocks of Sequence.render
+    parameters = {"sequence_length": 256, "noise_ratio": 0.2}
+    return create_automatone(parameters)._sequence
+
+
+@pytest.mark.parametrize("processes", [False, True])
+def test_parallel_render_is_identical(sequence, processes):
+    serial = sequence.render(SAMPLE_RATE, workers=1)
+    parallel = sequence.render(SAMPLE_RATE, workers=3, processes=processes)
+    np.testing.assert_array_equal(parallel, serial)
+
+
+@pytest.mark.parametrize("processes", [False, True])
+def test_parallel_mix_with_small_blocks_is_identical(sequence, processes):
+    n = int(np.ceil(SAMPLE_RATE * sequence.duration))
+    serial = np.zeros((n, 2))
+    Mixer(sequence.events, SAMPLE_RATE).mix(serial, 0, range(len(sequence)))
+
+    parallel = np.zeros((n, 2))
+    mixer = Mixer(sequence.events, SAMPLE_RATE)
+    mixer.mix_parallel(parallel, 4, block_size=1000, processes=processes)
+    np.testing.assert_array_equal(parallel, serial)